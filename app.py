@@ -1,10 +1,26 @@
 import json
+import math
 import os
 import dash
+import flask
 import dash_bootstrap_components as dbc
+from dash import ClientsideFunction
 from dash import dcc
 from dash import html
-import pandas as pd
+from flask_compress import Compress
+
+from meteorites.backends import backend_loader
+from meteorites.bitmaps import make_filters
+from meteorites.cache import QueryCache, normalize
+from meteorites.data import DataReloader, group_countries
+from meteorites.export import DataExport, export_query
+from meteorites.map_points import map_points, preview_points, zoom_level
+from meteorites.metrics import CallbackMetrics, timed
+from meteorites.recording import SessionRecorder
+from meteorites.responses import ResponseStore
+from meteorites.serialize import encode_figure
+from meteorites.spatial import viewport_bbox
+from meteorites import jobs, preview, warmup
 
 try:
     mapbox_access_token = os.environ['mapbox_access_token']
@@ -16,11 +32,53 @@ except:
 
 mapbox_style = "dark"
 
+# bar and year charts computed in the browser from aggregates shipped with the page
+clientside = os.environ.get('METEORITES_CLIENTSIDE') == '1'
+
 app = dash.Dash(external_stylesheets=[dbc.themes.CERULEAN])
 
 server = app.server
 
-df = pd.read_csv('data/meteorites.csv').sort_values(by=['year'])
+# pandas in memory, or duckdb over parquet, see meteorites.backends
+load_dataset = backend_loader()
+dataset = load_dataset()
+reloader = DataReloader(dataset, load_dataset)
+
+
+def current_dataset():
+    """The dataset of the current request, so a request running across a reload reads one version throughout."""
+    if flask.has_request_context() and 'dataset' in flask.g:
+        return flask.g.dataset
+    return dataset
+
+
+def dataset_key():
+    data = current_dataset()
+    return data.identity, data.version
+
+
+query_cache = QueryCache.from_env()
+query_cache.data_key = dataset_key
+metrics = CallbackMetrics(app, query_cache)
+recorder = SessionRecorder(app)
+exporter = DataExport(app, current_dataset)
+
+
+@server.before_request
+def reload_dataset():
+    # swap in ingested rows between requests, the request keeps the data it starts with
+    global dataset
+    dataset = flask.g.dataset = reloader.check()
+
+
+# the response store must come before Compress to keep the compressed bodies
+responses = ResponseStore(app, lambda: '{}:{}'.format(*dataset_key()),
+                          os.path.dirname(os.path.abspath(__file__)))
+if jobs.ENABLED:
+    # these answer with a job to poll, which must not be replayed
+    responses.exclude(['..graph-map.figure...map-view.data..', 'barchart.figure', 'year-chart.figure'])
+server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(server)
 
 dropdown_opt = [
     {"label": str(name), "value": str(name)}
@@ -28,370 +86,606 @@ dropdown_opt = [
                  'GDP ($ per capita)', 'Climate', 'Region']
 ]
 
-app.layout = html.Div(
-    id="root",
-    children=[
-        dbc.Navbar(
-            [
-                dbc.Col(
-                    html.H1("Meteorites Landing", style={
-                        'textAlign': 'center',
-                        'color': 'white'
-                    }),
-                    width={"size": 8, "offset": 2}
-                ),
-                dbc.Col(
-                    dbc.Row(
-                        [
-                            dbc.Col([
-                                dbc.Button("Data info", id='about', color="primary", className="ml-2"),
-                                dbc.Modal(
-                                    [
-                                        dbc.ModalHeader("About the data"),
-                                        dbc.ModalBody([
-                                            html.P(
-                                                "The data are coming from two different datasets. One dataset containing the meteorites information and another containing the countries information."),
-                                            html.H3("Meteorites landing data"),
-                                            html.A("Link to the dataset",
-                                                   href='https://data.nasa.gov/Space-Science/Meteorite-Landings/gh4g-9sfh',
-                                                   target="_blank"),
-                                            html.P("It contains 45.7k rows and 10 columns as follow: "),
-                                            dbc.Table(
-                                                id='meteorites-dataset',
-                                                children=[
-                                                    html.Thead(html.Tr(
-                                                        [html.Th("Column name"), html.Th("Description"),
-                                                         html.Th("Type")])),
-                                                    html.Tbody([
-                                                        html.Tr(
-                                                            [html.Td('name'), html.Td('Name giver to the meteorite'),
-                                                             html.Td('Text')]),
-                                                        html.Tr([html.Td('id'),
-                                                                 html.Td(
-                                                                     'Unique identification number of the meteorite'),
-                                                                 html.Td('Text')]),
-                                                        html.Tr([html.Td('nametype'), html.Td(
-                                                            'Valid: Typical meteorite / Relict: very old, highly degraded'),
-                                                                 html.Td('Text')]),
-                                                        html.Tr([html.Td('recclass'),
-                                                                 html.Td([html.A('Class of the meteorite',
-                                                                                 href='https://en.wikipedia.org/wiki/Meteorite_classification',
-                                                                                 target="_blank")]),
-                                                                 html.Td('Text')]),
-                                                        html.Tr([html.Td('Mass (g)'), html.Td('Mass in gram'),
-                                                                 html.Td('Number')]),
-                                                        html.Tr([html.Td('fall'), html.Td(
-                                                            'Fell: meteorite observed falling / Found: meteorite found after, not observed'),
+scatter_axes = ['Population', 'Area (km sq)', 'Pop. Density (per sq. km.)', 'GDP ($ per capita)']
+
+
+def barchart_layout(yaxis_type):
+    return dict(
+        margin=dict(r=0, l=30, t=0),
+        paper_bgcolor='rgba(0, 0, 0, 100)',
+        plot_bgcolor='rgba(0, 0, 0, 100)',
+        yaxis=dict(
+            type=yaxis_type,
+            tickfont=dict(color='white'),
+        ),
+        xaxis=dict(
+            tickfont=dict(color='white'),
+        ),
+        legend_title_text='Type of meteorites',
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01,
+            font=dict(
+                color="white"
+            ),
+        )
+    )
+
+
+def year_chart_layout():
+    return dict(
+        margin=dict(r=5, l=35, t=0, b=20),
+        paper_bgcolor='rgba(0, 0, 0, 100)',
+        plot_bgcolor='rgba(0, 0, 0, 100)',
+        automargin=True,
+        yaxis=dict(
+            tickfont=dict(color='white')
+        ),
+        xaxis=dict(
+            tickfont=dict(color='white'),
+        ),
+        legend_title_text='Type of meteorites',
+        legend=dict(
+            font=dict(
+                color="white"
+            ),
+        ),
+        title=dict(
+            text="Landing/year",
+            y=0.9,
+            x=0.5,
+            xanchor='center',
+            yanchor='center',
+            font=dict(
+                color="white"
+            ),
+        )
+    )
+
+
+def mass_label(exponent):
+    # slider positions are powers of ten grams
+    for unit_exponent, unit in [(6, 't'), (3, 'kg'), (0, 'g')]:
+        if exponent >= unit_exponent:
+            return f'{10 ** (exponent - unit_exponent)} {unit}'
+    return f'{10.0 ** exponent:g} g'
+
+
+@query_cache.memoize
+def get_values(column):
+    return current_dataset().values(column)
+
+
+@query_cache.memoize
+def get_mass_range():
+    low, high = current_dataset().mass_bounds()
+    return [math.floor(math.log10(low)), math.ceil(math.log10(high))]
+
+
+def get_filters(classes=None, nametype=None, mass=None):
+    """Filters of the class, name type and mass controls, None when they keep every meteorite."""
+    if nametype is not None and set(nametype) >= set(get_values('nametype')):
+        nametype = None
+    low = high = None
+    if mass is not None:
+        # the ends of the slider are open, the masses past them are kept
+        mass_range = get_mass_range()
+        if mass[0] > mass_range[0]:
+            low = 10.0 ** mass[0]
+        if mass[1] < mass_range[1]:
+            high = 10.0 ** mass[1]
+    return make_filters(classes, nametype, (low, high))
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_export(filters=None):
+    return current_dataset().export(filters)
+
+
+def clientside_data(filters=None):
+    # the cached export is shared, the chart settings go in a copy of it
+    data = dict(get_export(filters))
+    data['scatter_axes'] = scatter_axes
+    data['layouts'] = {'barchart': barchart_layout(''), 'year_chart': year_chart_layout()}
+    return data
+
+
+def serve_layout():
+    # built for every page, so the bounds and options follow the ingested rows
+    year_bounds = list(current_dataset().year_bounds())
+    mass_range = get_mass_range()
+    nametype_values = get_values('nametype')
+    return html.Div(
+        id="root",
+        children=[
+            dcc.Store(id='aggregates', data=clientside_data() if clientside else None),
+            dcc.Store(id='map-view'),
+            dbc.Navbar(
+                [
+                    dbc.Col(
+                        html.H1("Meteorites Landing", style={
+                            'textAlign': 'center',
+                            'color': 'white'
+                        }),
+                        width={"size": 8, "offset": 2}
+                    ),
+                    dbc.Col(
+                        dbc.Row(
+                            [
+                                dbc.Col([
+                                    dbc.Button("Data info", id='about', color="primary", className="ml-2"),
+                                    dbc.Modal(
+                                        [
+                                            dbc.ModalHeader("About the data"),
+                                            dbc.ModalBody([
+                                                html.P(
+                                                    "The data are coming from two different datasets. One dataset containing the meteorites information and another containing the countries information."),
+                                                html.H3("Meteorites landing data"),
+                                                html.A("Link to the dataset",
+                                                       href='https://data.nasa.gov/Space-Science/Meteorite-Landings/gh4g-9sfh',
+                                                       target="_blank"),
+                                                html.P("It contains 45.7k rows and 10 columns as follow: "),
+                                                dbc.Table(
+                                                    id='meteorites-dataset',
+                                                    children=[
+                                                        html.Thead(html.Tr(
+                                                            [html.Th("Column name"), html.Th("Description"),
+                                                             html.Th("Type")])),
+                                                        html.Tbody([
+                                                            html.Tr(
+                                                                [html.Td('name'), html.Td('Name giver to the meteorite'),
                                                                  html.Td('Text')]),
-                                                        html.Tr([html.Td('year'), html.Td(
-                                                            'Year the meteorite fell or has been discovered depending on the field “fall”'),
-                                                                 html.Td('Datetime')]),
-                                                        html.Tr([html.Td('reclat'), html.Td('Latitude of the landing'),
-                                                                 html.Td('Number')]),
-                                                        html.Tr([html.Td('reclong'), html.Td('Longitde of the landing'),
+                                                            html.Tr([html.Td('id'),
+                                                                     html.Td(
+                                                                         'Unique identification number of the meteorite'),
+                                                                     html.Td('Text')]),
+                                                            html.Tr([html.Td('nametype'), html.Td(
+                                                                'Valid: Typical meteorite / Relict: very old, highly degraded'),
+                                                                     html.Td('Text')]),
+                                                            html.Tr([html.Td('recclass'),
+                                                                     html.Td([html.A('Class of the meteorite',
+                                                                                     href='https://en.wikipedia.org/wiki/Meteorite_classification',
+                                                                                     target="_blank")]),
+                                                                     html.Td('Text')]),
+                                                            html.Tr([html.Td('Mass (g)'), html.Td('Mass in gram'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('fall'), html.Td(
+                                                                'Fell: meteorite observed falling / Found: meteorite found after, not observed'),
+                                                                     html.Td('Text')]),
+                                                            html.Tr([html.Td('year'), html.Td(
+                                                                'Year the meteorite fell or has been discovered depending on the field “fall”'),
+                                                                     html.Td('Datetime')]),
+                                                            html.Tr([html.Td('reclat'), html.Td('Latitude of the landing'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('reclong'), html.Td('Longitde of the landing'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('GeoLocation'),
+                                                                     html.Td(
+                                                                         'Coordinates of the landing “(reclat, reclong)”'),
+                                                                     html.Td('Tuple')]),
+                                                        ])
+                                                    ],
+                                                    bordered=True,
+                                                    dark=True,
+                                                    hover=True,
+                                                    responsive=True,
+                                                    striped=True,
+                                                ),
+                                                html.H3("Country data"),
+                                                html.A("Link to the dataset",
+                                                       href='https://www.kaggle.com/fernandol/countries-of-the-world',
+                                                       target="_blank"),
+                                                html.P(
+                                                    "It is extracted from The World Factbook, Central Intelligence Agency , compiling data from all countries. It is composed of 227 rows, and I filtered only 7 columns as follow:"),
+                                                dbc.Table(
+                                                    id='country-dataset',
+                                                    children=[
+                                                        html.Thead(html.Tr(
+                                                            [html.Th("Column name"), html.Th("Description"),
+                                                             html.Th("Type")])),
+                                                        html.Tbody([
+                                                            html.Tr([html.Td('Country'), html.Td('Name of the country'),
+                                                                     html.Td('Text')]),
+                                                            html.Tr([html.Td('Region'), html.Td(
+                                                                'Region name in: Baltics, eastern europe, western europe, asia (ex. near east), c.w. of ind. States, oceania, northern america, latin amer. & carib, northern africa, near east, sub-saharan africa, antarctica'),
+                                                                     html.Td('Text')]),
+                                                            html.Tr(
+                                                                [html.Td('Population'), html.Td('Number of inhabitants'),
                                                                  html.Td('Number')]),
-                                                        html.Tr([html.Td('GeoLocation'),
-                                                                 html.Td(
-                                                                     'Coordinates of the landing “(reclat, reclong)”'),
-                                                                 html.Td('Tuple')]),
-                                                    ])
-                                                ],
-                                                bordered=True,
-                                                dark=True,
-                                                hover=True,
-                                                responsive=True,
-                                                striped=True,
+                                                            html.Tr([html.Td('Area (km sq)'), html.Td('Area in km square'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('Pop. Density'), html.Td(
+                                                                'Population density in Pop./km sq (Population/Area)'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('GPD ($ per capita)'), html.Td(
+                                                                'Gross Domestic Product/ Population, useful to see how rich a country is.'),
+                                                                     html.Td('Number')]),
+                                                            html.Tr([html.Td('Climate'), html.Td(
+                                                                'Climate type in: Desert(ice or sand), Desert/Tropical, Tropical, Tropical/Temperate, Temperate, Other'),
+                                                                     html.Td('Text')]),
+                                                        ])
+                                                    ],
+                                                    bordered=True,
+                                                    dark=True,
+                                                    hover=True,
+                                                    responsive=True,
+                                                    striped=True,
+                                                )
+                                            ]),
+                                            dbc.ModalFooter(
+                                                dbc.Button("Close", id="close-modal", className="ml-2")
                                             ),
-                                            html.H3("Country data"),
-                                            html.A("Link to the dataset",
-                                                   href='https://www.kaggle.com/fernandol/countries-of-the-world',
-                                                   target="_blank"),
-                                            html.P(
-                                                "It is extracted from The World Factbook, Central Intelligence Agency , compiling data from all countries. It is composed of 227 rows, and I filtered only 7 columns as follow:"),
-                                            dbc.Table(
-                                                id='country-dataset',
+                                        ],
+                                        id="modal",
+                                        size='xl',
+                                    )],
+                                    width="auto",
+                                ),
+                            ],
+                            className="ml-auto flex-nowrap mt-3 mt-md-0",
+                            align="center",
+                        ),
+                        width=1),
+                ],
+                color="dark",
+                dark=True,
+                style={
+                    'marginBottom': '1rem',
+                }
+            ),
+            dbc.Container(
+                id="app-container",
+                fluid=True,
+                children=[
+                    dbc.Row(
+                        children=[
+                            dbc.Col(
+                                id="left-column",
+                                align='center',
+                                children=[
+                                    dbc.Card(
+                                        [
+                                            dbc.CardHeader(
+                                                id='control-panel',
                                                 children=[
-                                                    html.Thead(html.Tr(
-                                                        [html.Th("Column name"), html.Th("Description"),
-                                                         html.Th("Type")])),
-                                                    html.Tbody([
-                                                        html.Tr([html.Td('Country'), html.Td('Name of the country'),
-                                                                 html.Td('Text')]),
-                                                        html.Tr([html.Td('Region'), html.Td(
-                                                            'Region name in: Baltics, eastern europe, western europe, asia (ex. near east), c.w. of ind. States, oceania, northern america, latin amer. & carib, northern africa, near east, sub-saharan africa, antarctica'),
-                                                                 html.Td('Text')]),
-                                                        html.Tr(
-                                                            [html.Td('Population'), html.Td('Number of inhabitants'),
-                                                             html.Td('Number')]),
-                                                        html.Tr([html.Td('Area (km sq)'), html.Td('Area in km square'),
-                                                                 html.Td('Number')]),
-                                                        html.Tr([html.Td('Pop. Density'), html.Td(
-                                                            'Population density in Pop./km sq (Population/Area)'),
-                                                                 html.Td('Number')]),
-                                                        html.Tr([html.Td('GPD ($ per capita)'), html.Td(
-                                                            'Gross Domestic Product/ Population, useful to see how rich a country is.'),
-                                                                 html.Td('Number')]),
-                                                        html.Tr([html.Td('Climate'), html.Td(
-                                                            'Climate type in: Desert(ice or sand), Desert/Tropical, Tropical, Tropical/Temperate, Temperate, Other'),
-                                                                 html.Td('Text')]),
-                                                    ])
-                                                ],
-                                                bordered=True,
-                                                dark=True,
-                                                hover=True,
-                                                responsive=True,
-                                                striped=True,
-                                            )
-                                        ]),
-                                        dbc.ModalFooter(
-                                            dbc.Button("Close", id="close-modal", className="ml-2")
-                                        ),
-                                    ],
-                                    id="modal",
-                                    size='xl',
-                                )],
-                                width="auto",
-                            ),
-                        ],
-                        className="ml-auto flex-nowrap mt-3 mt-md-0",
-                        align="center",
-                    ),
-                    width=1),
-            ],
-            color="dark",
-            dark=True,
-            style={
-                'marginBottom': '1rem',
-            }
-        ),
-        dbc.Container(
-            id="app-container",
-            fluid=True,
-            children=[
-                dbc.Row(
-                    children=[
-                        dbc.Col(
-                            id="left-column",
-                            align='center',
-                            children=[
-                                dbc.Card(
-                                    [
-                                        dbc.CardHeader(
-                                            id='control-panel',
-                                            children=[
-                                                dbc.Row(
-                                                    children=[
-                                                        dbc.Col([
-                                                            dcc.RangeSlider(
-                                                                id='year-range-slider',
-                                                                min=df['year'].min(),
-                                                                max=df['year'].max(),
-                                                                step=1,
-                                                                value=[df['year'].min(), df['year'].max()],
-                                                                marks=None,
-                                                                # marks={
-                                                                #     df['year'].min(): f'{df["year"].min()}',
-                                                                #     (df['year'].min()+df['year'].max())//2: f'{(df["year"].min()+df["year"].max())//2}',
-                                                                #     df['year'].max(): f'{df["year"].max()}'
-                                                                # },
-                                                                updatemode='mouseup',
-                                                                pushable=True,
-                                                                tooltip=dict(
-                                                                    always_visible=True,
-                                                                )
-                                                            ),
-                                                            dbc.Label(
-                                                                "Filter by discovery year (or select range on the Landing/Year graph)",
-                                                                html_for='year-range-slider'),
-                                                        ],
-                                                            align='center',
-                                                        ),
-                                                        dbc.Col([
-                                                            dbc.Label("Select the type of meteorites"),
-                                                            dbc.Checklist(
-                                                                id='seen-found-check',
-                                                                options=[
-                                                                    {'label': 'Found', 'value': 'Found'},
-                                                                    {'label': 'Seen', 'value': 'Fell'},
-                                                                ],
-                                                                value=['Found', 'Fell'],
-                                                                inline=False,
+                                                    dbc.Row(
+                                                        children=[
+                                                            dbc.Col([
+                                                                dcc.RangeSlider(
+                                                                    id='year-range-slider',
+                                                                    min=year_bounds[0],
+                                                                    max=year_bounds[1],
+                                                                    step=1,
+                                                                    value=year_bounds,
+                                                                    marks=None,
+                                                                    # marks={
+                                                                    #     df['year'].min(): f'{df["year"].min()}',
+                                                                    #     (df['year'].min()+df['year'].max())//2: f'{(df["year"].min()+df["year"].max())//2}',
+                                                                    #     df['year'].max(): f'{df["year"].max()}'
+                                                                    # },
+                                                                    updatemode='mouseup',
+                                                                    pushable=True,
+                                                                    tooltip=dict(
+                                                                        always_visible=True,
+                                                                    )
+                                                                ),
+                                                                dbc.Label(
+                                                                    "Filter by discovery year (or select range on the Landing/Year graph)",
+                                                                    html_for='year-range-slider'),
+                                                            ],
+                                                                align='center',
                                                             ),
-                                                        ]
-                                                        ),
-                                                        dbc.Col([
-                                                            dbc.Label("Type of map"),
-                                                            dbc.RadioItems(
-                                                                options=[
-                                                                    {"label": "Dark mode", "value": 'dark'},
-                                                                    {"label": "Topographic map",
-                                                                     "value": 'stamen-terrain'},
-                                                                ],
-                                                                value='dark',
-                                                                id="type-map",
+                                                            dbc.Col([
+                                                                dbc.Label("Select the type of meteorites"),
+                                                                dbc.Checklist(
+                                                                    id='seen-found-check',
+                                                                    options=[
+                                                                        {'label': 'Found', 'value': 'Found'},
+                                                                        {'label': 'Seen', 'value': 'Fell'},
+                                                                    ],
+                                                                    value=['Found', 'Fell'],
+                                                                    inline=False,
+                                                                ),
+                                                            ]
                                                             ),
-                                                        ])
-                                                    ]),
-                                            ]),
-                                        dbc.CardBody(
-                                            dcc.Graph(
-                                                id='graph-map',
-                                                style={'height': '50vh'}
+                                                            dbc.Col([
+                                                                dbc.Label("Type of map"),
+                                                                dbc.RadioItems(
+                                                                    options=[
+                                                                        {"label": "Dark mode", "value": 'dark'},
+                                                                        {"label": "Topographic map",
+                                                                         "value": 'stamen-terrain'},
+                                                                    ],
+                                                                    value='dark',
+                                                                    id="type-map",
+                                                                ),
+                                                            ])
+                                                        ]),
+                                                    dbc.Row(
+                                                        children=[
+                                                            dbc.Col([
+                                                                dbc.Label("Filter by class", html_for='class-dropdown'),
+                                                                dcc.Dropdown(
+                                                                    id='class-dropdown',
+                                                                    options=[{"label": value, "value": value}
+                                                                             for value in get_values('recclass')],
+                                                                    value=[],
+                                                                    multi=True,
+                                                                    placeholder="All classes",
+                                                                ),
+                                                            ]),
+                                                            dbc.Col([
+                                                                dbc.Label("Name type"),
+                                                                dbc.Checklist(
+                                                                    id='nametype-check',
+                                                                    options=[{'label': value, 'value': value}
+                                                                             for value in nametype_values],
+                                                                    value=nametype_values,
+                                                                    inline=True,
+                                                                ),
+                                                            ]),
+                                                            dbc.Col([
+                                                                dcc.RangeSlider(
+                                                                    id='mass-range-slider',
+                                                                    min=mass_range[0],
+                                                                    max=mass_range[1],
+                                                                    step=0.1,
+                                                                    value=mass_range,
+                                                                    marks={exponent: mass_label(exponent)
+                                                                           for exponent in range(mass_range[0], mass_range[1] + 1)
+                                                                           if exponent % 3 == 0},
+                                                                    updatemode='mouseup',
+                                                                ),
+                                                                dbc.Label("Filter by mass", html_for='mass-range-slider'),
+                                                            ]),
+                                                            dbc.Col([
+                                                                dbc.Label("Download the selection"),
+                                                                dbc.ButtonGroup([
+                                                                    dbc.Button("CSV", id='export-csv', download='meteorites.csv',
+                                                                               external_link=True, size='sm'),
+                                                                    dbc.Button("Arrow", id='export-arrow',
+                                                                               download='meteorites.arrow',
+                                                                               external_link=True, size='sm'),
+                                                                ]),
+                                                            ], width='auto'),
+                                                        ]),
+                                                ]),
+                                            dbc.CardBody(
+                                                dcc.Graph(
+                                                    id='graph-map',
+                                                    style={'height': '50vh'}
+                                                )
                                             )
-                                        )
-                                    ]
-                                ),
-                            ], width=6),
-                        dbc.Col(
-                            id="right-column",
-                            align='center',
-                            children=[
-                                dbc.Card(
-                                    [
-                                        dbc.CardHeader(
-                                            id="graph-container",
-                                            children=[
-                                                dbc.Row(
-                                                    children=[
-                                                        dbc.Col([
-                                                            dbc.Label("Graph controls"),
-                                                            dbc.Checklist(
-                                                                options=[
-                                                                    {"label": "Log scale Y axis",
-                                                                     "value": 'log'},
-                                                                    {"label": "Density (Count/Area in km/sq)",
-                                                                     "value": 'density'},
-                                                                ],
-                                                                value=[],
-                                                                id="graph-input",
-                                                                switch=True,
-                                                            )]),
-                                                        dbc.Col([
-                                                            html.P(id="chart-selector", children="Select x:"),
-                                                            dcc.Dropdown(
-                                                                options=dropdown_opt,
-                                                                value="Country",
-                                                                id="chart-dropdown",
-                                                                clearable=False,
-                                                                style={
-                                                                    'color': 'black'
-                                                                }
-                                                            ),
+                                        ]
+                                    ),
+                                ], width=6),
+                            dbc.Col(
+                                id="right-column",
+                                align='center',
+                                children=[
+                                    dbc.Card(
+                                        [
+                                            dbc.CardHeader(
+                                                id="graph-container",
+                                                children=[
+                                                    dbc.Row(
+                                                        children=[
+                                                            dbc.Col([
+                                                                dbc.Label("Graph controls"),
+                                                                dbc.Checklist(
+                                                                    options=[
+                                                                        {"label": "Log scale Y axis",
+                                                                         "value": 'log'},
+                                                                        {"label": "Density (Count/Area in km/sq)",
+                                                                         "value": 'density'},
+                                                                    ],
+                                                                    value=[],
+                                                                    id="graph-input",
+                                                                    switch=True,
+                                                                )]),
+                                                            dbc.Col([
+                                                                html.P(id="chart-selector", children="Select x:"),
+                                                                dcc.Dropdown(
+                                                                    options=dropdown_opt,
+                                                                    value="Country",
+                                                                    id="chart-dropdown",
+                                                                    clearable=False,
+                                                                    style={
+                                                                        'color': 'black'
+                                                                    }
+                                                                ),
+                                                            ]),
                                                         ]),
-                                                    ]),
-                                            ]),
-                                        dbc.CardBody(
-                                            dcc.Graph(
-                                                id="barchart",
-                                                style={'height': '50vh'}
+                                                ]),
+                                            dbc.CardBody(
+                                                dcc.Graph(
+                                                    id="barchart",
+                                                    style={'height': '50vh'}
+                                                ),
                                             ),
-                                        ),
-                                    ]),
+                                        ]),
 
-                            ],
-                            width=6),
-                    ]),
-                dbc.Row(
-                    dbc.Col(
-                        dbc.Card(
-                            dcc.Graph(
-                                id="year-chart",
-                                config={
-                                    'displayModeBar': False
-                                },
-                                style={'height': '14vh'}
-                            ),
-                            body=True,
-                            style={
-                                'marginTop': '5px'
-                            }
-
-                        )
-                        , width=12),
-                )
-            ])
-    ])
-
-
-def get_filtered_df(years, fall):
-    # filter year range
-    df_filter = df[(df["year"] >= years[0]) & (df["year"] <= years[1])]
-
-    # filter seen_found
-    df_filter = df_filter[df_filter["fall"].isin(fall)]
-    return df_filter
-
-
-def get_by_country(years, fall):
-    df_by_country = get_filtered_df(years, fall)
-    df_by_country = df_by_country.groupby(
-        ['Country', 'ISO 3166-1 alpha-3', 'Population', 'Area (km sq)', 'Pop. Density (per sq. km.)',
-         'GDP ($ per capita)', 'Climate', 'Region', 'fall'])[['fall']].count()
-    df_by_country.rename(columns={"fall": 'count'}, inplace=True)
-    df_by_country = df_by_country.reset_index()
-    df_by_country.sort_values(by='count', inplace=True)
-    df_by_country['density'] = df_by_country['count'] / df_by_country['Area (km sq)']
-    return df_by_country
-
-
-def get_by_other(years, fall, xaxis):
-    df_other = get_by_country(years, fall).groupby([xaxis, 'fall'])[['count', 'Area (km sq)']].sum().reset_index()
-    df_other.rename(columns={"name": "count"}, inplace=True)
-    df_other.sort_values(by='count', inplace=True)
-    df_other['density'] = df_other['count'] / df_other['Area (km sq)']
-    return df_other
-
-
-def get_by_years(years, fall):
-    df_years = get_filtered_df(years, fall)
-    df_years = df_years.groupby(['year', 'fall'])['name'].count().reset_index()
-    df_years.rename(columns={"name": "count"}, inplace=True)
-    df_years.sort_values(by='year', inplace=True)
-    return df_years
+                                ],
+                                width=6),
+                        ]),
+                    dbc.Row(
+                        dbc.Col(
+                            dbc.Card(
+                                dcc.Graph(
+                                    id="year-chart",
+                                    config={
+                                        'displayModeBar': False
+                                    },
+                                    style={'height': '14vh'}
+                                ),
+                                body=True,
+                                style={
+                                    'marginTop': '5px'
+                                }
 
+                            )
+                            , width=12),
+                    )
+                ])
+        ])
 
-@app.callback(
-    dash.dependencies.Output('graph-map', 'figure'),
-    [dash.dependencies.Input('year-range-slider', 'value'),
-     dash.dependencies.Input('seen-found-check', 'value'),
-     dash.dependencies.Input('type-map', 'value')],
-    [dash.dependencies.State('graph-map', "relayoutData")]
-)
-def update_graph(years, fall, map_style, graph_layout):
-    df_filter = get_filtered_df(years, fall)
 
+app.layout = serve_layout
+
+
+@timed('filtering')
+@query_cache.memoize
+def get_filtered_df(years, fall, filters=None):
+    return current_dataset().filtered(years, fall, filters)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_by_country(years, fall, filters=None):
+    return current_dataset().by_country(years, fall, filters)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_by_other(years, fall, xaxis, filters=None):
+    return current_dataset().by_other(years, fall, xaxis, filters)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_by_years(years, fall, filters=None):
+    return current_dataset().by_years(years, fall, filters)
+
+
+@timed('filtering')
+@query_cache.memoize
+def get_map_df(years, fall, bbox, filters=None):
+    return current_dataset().map_frame(years, fall, bbox, filters)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_map_points(years, fall, level, bbox, filters=None):
+    return map_points(get_map_df(years, fall, bbox, filters), level)
+
+
+@timed('filtering')
+@query_cache.memoize
+def get_map_sample(fall, filters=None):
+    data = current_dataset()
+    return preview.sample(data.map_frame(list(data.year_bounds()), fall, None, filters))
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_preview_points(years, fall, level, bbox, filters=None):
+    df_sample, weight = get_map_sample(fall, filters)
+    return preview_points(preview.in_view(df_sample, years, bbox), level, weight)
+
+
+@timed('filtering')
+@query_cache.memoize
+def get_preview_cube(filters):
+    data = current_dataset()
+    return preview.sample_cube(data.filtered(list(data.year_bounds()), get_values('fall'), filters))
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_preview_by_country(years, fall, filters):
+    cube, weight = get_preview_cube(filters)
+    return preview.scale_counts(cube.by_country(years, fall), weight)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_preview_by_other(years, fall, xaxis, filters):
+    return group_countries(get_preview_by_country(years, fall, filters), xaxis)
+
+
+@timed('aggregation')
+@query_cache.memoize
+def get_preview_by_years(years, fall, filters):
+    cube, weight = get_preview_cube(filters)
+    return preview.scale_counts(cube.by_years(years, fall), weight)
+
+
+filter_inputs = [dash.dependencies.Input('class-dropdown', 'value'),
+                 dash.dependencies.Input('nametype-check', 'value'),
+                 dash.dependencies.Input('mass-range-slider', 'value')]
+
+# while dragging, the slider reports drag_value on every tick and value on release:
+# the server callbacks preview it when previews are on, the clientside charts follow it exactly
+drag_input = dash.dependencies.Input('year-range-slider', 'drag_value')
+drag_inputs = [drag_input] if preview.ENABLED else []
+
+
+def slider_years(years, drag_years):
+    """Years to show, and whether they are a snapped preview of a drag tick."""
+    if drag_years is None or not preview.ENABLED:
+        return years, False
+    triggered = dash.callback_context.triggered_prop_ids
+    if 'year-range-slider.drag_value' in triggered and 'year-range-slider.value' not in triggered:
+        return preview.snap(drag_years, current_dataset().year_bounds()), True
+    return years, False
+
+
+def marker_color(map_style):
     if map_style == 'dark':
-        marker_color = 'rgb(206, 118, 100)'
+        return 'rgb(206, 118, 100)'
+    return 'rgba(99, 110, 250, 100)'
+
+
+def map_view(graph_layout):
+    """``(lat, lon, zoom, bbox)`` of the map after a relayout, the initial view before any."""
+    if graph_layout is None or "mapbox.center" not in graph_layout.keys():
+        return 0, 0, 0.5, None
+    return (float(graph_layout["mapbox.center"]["lat"]), float(graph_layout["mapbox.center"]["lon"]),
+            float(graph_layout["mapbox.zoom"]), viewport_bbox(graph_layout))
+
+
+def get_shown_points(years, fall, zoom, bbox, filters=None, drag_years=None):
+    """Points of the map, whether they are binned, and a key telling apart the point sets."""
+    years, dragging = slider_years(years, drag_years)
+    level = zoom_level(zoom)
+    if dragging:
+        points, binned = get_preview_points(years, fall, level, bbox, filters)
     else:
-        marker_color = 'rgba(99, 110, 250, 100)'
-
-    trace = [
-        dict(
-            type="scattermapbox",
-            lat=df_filter.reclat,
-            lon=df_filter.reclong,
-            text=df_filter.year,
-            hoverinfo='text',
-            mode='markers',
-            marker=dict(
-                size=5,
-                color=marker_color,
-                opacity=0.4),
-        )
-    ]
+        # points under the viewport only, binned at low zoom
+        points, binned = get_map_points(years, fall, level, bbox, filters)
+    return points, binned, repr(normalize((years, fall, level, bbox, filters, dragging)))
+
+
+def map_trace(points, binned, map_style):
+    return dict(
+        type="scattermapbox",
+        lat=points.reclat,
+        lon=points.reclong,
+        # numbers in customdata go out as a typed array, unlike text
+        customdata=points['count'] if binned else points.year,
+        hovertemplate='%{customdata} meteorites<extra></extra>' if binned else '%{customdata}<extra></extra>',
+        mode='markers',
+        marker=dict(
+            size=points['size'] if binned else 5,
+            color=marker_color(map_style),
+            opacity=0.6 if binned else 0.4),
+    )
 
-    lat = 0
-    lon = 0
-    zoom = 0.5
-    if graph_layout is not None:
-        if "mapbox.center" in graph_layout.keys():
-            lon = float(graph_layout["mapbox.center"]["lon"])
-            lat = float(graph_layout["mapbox.center"]["lat"])
-            zoom = float(graph_layout["mapbox.zoom"])
+
+def update_graph(years, fall, map_style, graph_layout, classes=None, nametype=None, mass=None, drag_years=None):
+    lat, lon, zoom, bbox = map_view(graph_layout)
+    points, binned, _ = get_shown_points(years, fall, zoom, bbox, get_filters(classes, nametype, mass), drag_years)
+
+    trace = [map_trace(points, binned, map_style)]
 
     layout = dict(
         hovermode='closest',
         margin=dict(r=0, l=0, t=0, b=0),
+        # patches below must not reset the view the user panned to
+        uirevision='map',
         mapbox=dict(
             accesstoken=mapbox_access_token,
             bearing=0,
@@ -404,27 +698,74 @@ def update_graph(years, fall, map_style, graph_layout):
         ),
     )
     fig = dict(data=trace, layout=layout)
-    return fig
+    return encode_figure(fig)
 
 
 @app.callback(
-    dash.dependencies.Output("barchart", "figure"),
-    [dash.dependencies.Input("chart-dropdown", "value"),
-     dash.dependencies.Input("year-range-slider", "value"),
+    [dash.dependencies.Output('graph-map', 'figure'),
+     dash.dependencies.Output('map-view', 'data')],
+    [dash.dependencies.Input('year-range-slider', 'value'),
      dash.dependencies.Input('seen-found-check', 'value'),
-     dash.dependencies.Input('graph-input', 'value')],
+     dash.dependencies.Input('type-map', 'value'),
+     dash.dependencies.Input('graph-map', "relayoutData")] + filter_inputs + drag_inputs,
+    [dash.dependencies.State('map-view', 'data')],
+    **jobs.callback_options()
 )
-def display_barchart(chart_dropdown, years, fall, graph_input):
-    if chart_dropdown in ['Population', 'Area (km sq)',
-                          'Pop. Density (per sq. km.)', 'GDP ($ per capita)']:
-        df_display = get_by_country(years, fall)
+def update_map(*args):
+    """Map figure, patched rather than resent once shown.
+
+    ``map-view`` holds the key of the points on the map. A style change only
+    patches the style and the marker color; a relayout or a control change
+    sends new points if they differ from the ones shown, nothing otherwise.
+    """
+    *inputs, shown = args
+    years, fall, map_style, graph_layout, classes, nametype, mass = inputs[:7]
+    triggered = dash.callback_context.triggered_prop_ids
+    relayout = list(triggered) == ['graph-map.relayoutData']
+    if relayout and graph_layout is not None and "mapbox.center" not in graph_layout.keys():
+        # autosize and other relayouts that do not move the map
+        raise dash.exceptions.PreventUpdate
+
+    if shown is not None and list(triggered) == ['type-map.value']:
+        patch = dash.Patch()
+        patch['layout']['mapbox']['style'] = map_style
+        patch['data'][0]['marker']['color'] = marker_color(map_style)
+        return patch, dash.no_update
+
+    lat, lon, zoom, bbox = map_view(graph_layout)
+    points, binned, key = get_shown_points(years, fall, zoom, bbox, get_filters(classes, nametype, mass), *inputs[7:])
+    if shown is None:
+        return update_graph(*inputs), key
+    if key == shown:
+        # a pan or zoom that keeps the same points, the figure follows the map by itself
+        raise dash.exceptions.PreventUpdate
+
+    trace = encode_figure(dict(data=[map_trace(points, binned, map_style)]))['data'][0]
+    patch = dash.Patch()
+    for name in ['lat', 'lon', 'customdata', 'hovertemplate']:
+        patch['data'][0][name] = trace[name]
+    for name in ['size', 'opacity']:
+        patch['data'][0]['marker'][name] = trace['marker'][name]
+    return patch, key
+
+
+def display_barchart(chart_dropdown, years, fall, graph_input, classes=None, nametype=None, mass=None,
+                     drag_years=None):
+    filters = get_filters(classes, nametype, mass)
+    years, dragging = slider_years(years, drag_years)
+    by_country, by_other = get_by_country, get_by_other
+    if dragging and filters is not None:
+        # the cube of the table only answers without filters, a filtered drag tick counts a sample
+        by_country, by_other = get_preview_by_country, get_preview_by_other
+    if chart_dropdown in scatter_axes:
+        df_display = by_country(years, fall, filters)
         type_graph = 'scatter'
         mode_graph = 'markers'
     else:
         if chart_dropdown == 'Country':
-            df_display = get_by_country(years, fall)
+            df_display = by_country(years, fall, filters)
         else:
-            df_display = get_by_other(years, fall, chart_dropdown)
+            df_display = by_other(years, fall, chart_dropdown, filters)
         type_graph = 'bar'
         mode_graph = 'none'
 
@@ -449,40 +790,47 @@ def display_barchart(chart_dropdown, years, fall, graph_input):
             )
         )
 
-    layout = dict(
-        margin=dict(r=0, l=30, t=0),
-        paper_bgcolor='rgba(0, 0, 0, 100)',
-        plot_bgcolor='rgba(0, 0, 0, 100)',
-        yaxis=dict(
-            type=yaxis_type,
-            tickfont=dict(color='white'),
-        ),
-        xaxis=dict(
-            tickfont=dict(color='white'),
-        ),
-        legend_title_text='Type of meteorites',
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="left",
-            x=0.01,
-            font=dict(
-                color="white"
-            ),
-        )
-    )
+    layout = barchart_layout(yaxis_type)
 
     fig = dict(data=trace, layout=layout)
-    return fig
+    return encode_figure(fig)
 
 
-@app.callback(
-    dash.dependencies.Output("year-chart", "figure"),
-    [dash.dependencies.Input("year-range-slider", "value"),
-     dash.dependencies.Input('seen-found-check', 'value')],
-)
-def display_year_chart(years, fall):
-    df_years = get_by_years(years, fall)
+barchart_inputs = [dash.dependencies.Input("chart-dropdown", "value"),
+                   dash.dependencies.Input("year-range-slider", "value"),
+                   dash.dependencies.Input('seen-found-check', 'value'),
+                   dash.dependencies.Input('graph-input', 'value')]
+
+if clientside:
+    # the browser gets new aggregates when the filters change, the cube does not know them
+    @app.callback(
+        dash.dependencies.Output('aggregates', 'data'),
+        filter_inputs,
+        prevent_initial_call=True,
+    )
+    def update_aggregates(classes, nametype, mass):
+        return clientside_data(get_filters(classes, nametype, mass))
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='meteorites', function_name='display_barchart'),
+        dash.dependencies.Output("barchart", "figure"),
+        barchart_inputs + [drag_input, dash.dependencies.Input('aggregates', 'data')],
+    )
+else:
+    app.callback(
+        dash.dependencies.Output("barchart", "figure"),
+        barchart_inputs + filter_inputs + drag_inputs,
+        **jobs.callback_options()
+    )(display_barchart)
+
+
+def display_year_chart(years, fall, classes=None, nametype=None, mass=None, drag_years=None):
+    filters = get_filters(classes, nametype, mass)
+    years, dragging = slider_years(years, drag_years)
+    if dragging and filters is not None:
+        df_years = get_preview_by_years(years, fall, filters)
+    else:
+        df_years = get_by_years(years, fall, filters)
     trace = []
     for i in fall:
         trace.append(
@@ -495,37 +843,38 @@ def display_year_chart(years, fall):
             )
         )
 
-    layout = dict(
-        margin=dict(r=5, l=35, t=0, b=20),
-        paper_bgcolor='rgba(0, 0, 0, 100)',
-        plot_bgcolor='rgba(0, 0, 0, 100)',
-        automargin=True,
-        yaxis=dict(
-            tickfont=dict(color='white')
-        ),
-        xaxis=dict(
-            tickfont=dict(color='white'),
-        ),
-        legend_title_text='Type of meteorites',
-        legend=dict(
-            font=dict(
-                color="white"
-            ),
-        ),
-        title=dict(
-            text="Landing/year",
-            y=0.9,
-            x=0.5,
-            xanchor='center',
-            yanchor='center',
-            font=dict(
-                color="white"
-            ),
-        )
-    )
+    layout = year_chart_layout()
 
     fig = dict(data=trace, layout=layout)
-    return fig
+    return encode_figure(fig)
+
+
+year_chart_inputs = [dash.dependencies.Input("year-range-slider", "value"),
+                     dash.dependencies.Input('seen-found-check', 'value')]
+
+if clientside:
+    app.clientside_callback(
+        ClientsideFunction(namespace='meteorites', function_name='display_year_chart'),
+        dash.dependencies.Output("year-chart", "figure"),
+        year_chart_inputs + [drag_input, dash.dependencies.Input('aggregates', 'data')],
+    )
+else:
+    app.callback(
+        dash.dependencies.Output("year-chart", "figure"),
+        year_chart_inputs + filter_inputs + drag_inputs,
+        **jobs.callback_options()
+    )(display_year_chart)
+
+
+@app.callback(
+    [dash.dependencies.Output('export-csv', 'href'),
+     dash.dependencies.Output('export-arrow', 'href')],
+    [dash.dependencies.Input('year-range-slider', 'value'),
+     dash.dependencies.Input('seen-found-check', 'value')] + filter_inputs,
+)
+def update_export_links(years, fall, classes, nametype, mass):
+    query = export_query(years, fall, get_filters(classes, nametype, mass))
+    return f'/export.csv?{query}', f'/export.arrow?{query}'
 
 
 @app.callback(
@@ -536,7 +885,7 @@ def update_slider(layout):
     if layout is not None:
         if 'xaxis.range[0]' in layout:
             return [int(layout['xaxis.range[0]']), int(layout['xaxis.range[1]']) + 1]
-    return [df['year'].min(), df['year'].max()]
+    return list(current_dataset().year_bounds())
 
 
 @app.callback(
@@ -551,5 +900,9 @@ def toggle_modal(n1, n2, is_open):
     return is_open
 
 
+if warmup.ENABLED:
+    # fill the query cache and the response store with the default view before the first visitor
+    warmup.warm_up(app)
+
 if __name__ == '__main__':
     app.run_server(debug=False)
@@ -0,0 +1,134 @@
+// Clientside versions of display_barchart and display_year_chart, used when
+// METEORITES_CLIENTSIDE=1. They read the aggregates stored in the page by
+// app.py (see CountCube.export) and mirror the server callbacks.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    meteorites: {
+        display_barchart: function (chart_dropdown, years, fall, graph_input, drag_years, data) {
+            years = sliderYears(years, drag_years);
+            var first = lowerBound(data.years, years[0]);
+            var last = upperBound(data.years, years[1]);
+            var cells = data.cells;
+            var countries = data.countries;
+            var area = countries['Area (km sq)'];
+            var nCountries = area.length;
+
+            // counts[fall][country] over the year range
+            var counts = data.fall.map(function () {
+                return new Array(nCountries).fill(0);
+            });
+            for (var i = 0; i < cells.year.length; i++) {
+                if (cells.year[i] >= first && cells.year[i] < last) {
+                    counts[cells.fall[i]][cells.country[i]] += cells.count[i];
+                }
+            }
+
+            var byCountry = chart_dropdown === 'Country' || data.scatter_axes.indexOf(chart_dropdown) >= 0;
+            var densityMode = graph_input.indexOf('density') >= 0;
+            var trace = fall.map(function (value) {
+                var f = data.fall.indexOf(value);
+                var rows = [];
+                if (f >= 0) {
+                    if (byCountry) {
+                        counts[f].forEach(function (count, c) {
+                            if (count > 0) {
+                                rows.push({x: countries[chart_dropdown][c], count: count, area: area[c]});
+                            }
+                        });
+                    } else {
+                        // same as get_by_other: sum over the countries of each group
+                        var groups = {};
+                        counts[f].forEach(function (count, c) {
+                            if (count > 0) {
+                                var key = countries[chart_dropdown][c];
+                                if (!(key in groups)) {
+                                    groups[key] = {x: key, count: 0, area: 0};
+                                    rows.push(groups[key]);
+                                }
+                                groups[key].count += count;
+                                groups[key].area += area[c];
+                            }
+                        });
+                    }
+                }
+                rows.sort(function (a, b) {
+                    return a.count - b.count;
+                });
+                var isScatter = data.scatter_axes.indexOf(chart_dropdown) >= 0;
+                return {
+                    type: isScatter ? 'scatter' : 'bar',
+                    mode: isScatter ? 'markers' : 'none',
+                    x: rows.map(function (row) {
+                        return row.x;
+                    }),
+                    y: rows.map(function (row) {
+                        return densityMode ? row.count / row.area : row.count;
+                    }),
+                    name: value
+                };
+            });
+
+            var layout = JSON.parse(JSON.stringify(data.layouts.barchart));
+            layout.yaxis.type = graph_input.indexOf('log') >= 0 ? 'log' : '';
+            return {data: trace, layout: layout};
+        },
+
+        display_year_chart: function (years, fall, drag_years, data) {
+            years = sliderYears(years, drag_years);
+            var first = lowerBound(data.years, years[0]);
+            var last = upperBound(data.years, years[1]);
+            var trace = fall.map(function (value) {
+                var f = data.fall.indexOf(value);
+                var x = [];
+                var y = [];
+                if (f >= 0) {
+                    for (var i = first; i < last; i++) {
+                        if (data.year_counts[i][f] > 0) {
+                            x.push(data.years[i]);
+                            y.push(data.year_counts[i][f]);
+                        }
+                    }
+                }
+                return {type: 'scatter', mode: 'lines', x: x, y: y, name: value};
+            });
+            return {data: trace, layout: JSON.parse(JSON.stringify(data.layouts.year_chart))};
+        }
+    }
+});
+
+// drag_value while the slider is dragged, value once released
+function sliderYears(years, dragYears) {
+    var triggered = window.dash_clientside.callback_context.triggered.map(function (t) {
+        return t.prop_id;
+    });
+    if (dragYears && triggered.indexOf('year-range-slider.drag_value') >= 0 &&
+        triggered.indexOf('year-range-slider.value') < 0) {
+        return dragYears;
+    }
+    return years;
+}
+
+function lowerBound(values, target) {
+    var lo = 0, hi = values.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (values[mid] < target) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo;
+}
+
+function upperBound(values, target) {
+    var lo = 0, hi = values.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (values[mid] <= target) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo;
+}
@@ -0,0 +1,395 @@
+"""Load test of the Dash callbacks, replaying sessions against gunicorn.
+
+Starts ``gunicorn app:server`` locally for each worker count and runs, for
+each concurrency level, that many virtual users replaying sessions as raw
+``/_dash-update-component`` POSTs. A session is a list of steps, each a think
+time and the requests the browser sends for one interaction. Sessions come
+from a recording made with ``METEORITES_RECORD`` or are generated from the
+layout and callback dependencies of the app: slider drags, year chart
+selections feeding ``update_slider``, checklist toggles, dropdown and filter
+changes, map moves and map style switches. Like the browser, a virtual user
+fills the state of a callback (e.g. ``map-view``) from the answers it got, so
+a style switch reaches the patch path of ``update_map``. Reports throughput,
+p50/p95/p99 latency and error rate per callback.
+
+    python benchmarks/loadtest.py --workers 1 2 4 --users 1 8 32 --duration 30
+    python benchmarks/loadtest.py --recording requests.jsonl --output load.json
+
+A virtual user sends the requests of a step one after the other, where a
+browser would send some of them in parallel.
+"""
+import argparse
+import copy
+import gzip
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from meteorites.warmup import callback_body, component_props  # noqa: E402
+
+DASH_UPDATE = '/_dash-update-component'
+# requests of one interaction are less than this apart in a recording
+STEP_GAP = 0.05
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def start_server(workers, port, env, timeout=300):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:server', '--workers', str(workers),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=ROOT, env=dict(os.environ, **env))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            get_json(f'http://127.0.0.1:{port}/_dash-dependencies')
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not answer within {timeout} s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def option_values(options):
+    return [option['value'] if isinstance(option, dict) else option for option in options or []]
+
+
+class SessionGenerator:
+    """Generates sessions the way the Dash renderer would send them."""
+
+    def __init__(self, layout, dependencies, seed=0):
+        self.initial_props = component_props(layout)
+        # clientside callbacks never reach the server
+        self.callbacks = [dep for dep in dependencies if not dep.get('clientside_function')]
+        self.rng = random.Random(seed)
+
+    def _requests(self, props, changes):
+        props.update(changes)
+        return [callback_body(callback, props, changes) for callback in self.callbacks
+                if any((item['id'], item['property']) in changes for item in callback['inputs'])]
+
+    def _has(self, props, component_id, prop='value'):
+        return (component_id, prop) in props
+
+    def _slider_drag(self, props):
+        low, high = props['year-range-slider', 'min'], props['year-range-slider', 'max']
+        start = self.rng.randint(low, high - 1)
+        end = self.rng.randint(start + 1, high)
+        steps = []
+        current = list(props['year-range-slider', 'value'])
+        for tick in range(self.rng.randint(3, 8)):
+            fraction = (tick + 1) / 8
+            current = [round(current[0] + (start - current[0]) * fraction),
+                       round(current[1] + (end - current[1]) * fraction)]
+            steps.append((0.1, {('year-range-slider', 'drag_value'): current}))
+        steps.append((0.1, {('year-range-slider', 'drag_value'): [start, end],
+                            ('year-range-slider', 'value'): [start, end]}))
+        return steps
+
+    def _year_selection(self, props):
+        low, high = props['year-range-slider', 'min'], props['year-range-slider', 'max']
+        start = self.rng.randint(low, high - 1)
+        end = self.rng.randint(start, high - 1)
+        relayout = {'xaxis.range[0]': start + self.rng.random(), 'xaxis.range[1]': end + self.rng.random()}
+        # update_slider answers [start, end + 1], which fires the figure callbacks
+        return [(0, {('year-chart', 'relayoutData'): relayout}),
+                (0, {('year-range-slider', 'value'): [start, end + 1]})]
+
+    def _toggle(self, props, component_id):
+        options = option_values(props.get((component_id, 'options')))
+        value = list(props.get((component_id, 'value')) or [])
+        flipped = self.rng.choice(options)
+        value = [v for v in value if v != flipped] if flipped in value else value + [flipped]
+        return [(0, {(component_id, 'value'): value})]
+
+    def _choose(self, props, component_id):
+        options = option_values(props.get((component_id, 'options')))
+        return [(0, {(component_id, 'value'): self.rng.choice(options)})]
+
+    def _classes(self, props):
+        options = option_values(props.get(('class-dropdown', 'options')))
+        picked = self.rng.sample(options, min(len(options), self.rng.randint(0, 3)))
+        return [(0, {('class-dropdown', 'value'): picked})]
+
+    def _mass(self, props):
+        low, high = props['mass-range-slider', 'min'], props['mass-range-slider', 'max']
+        start = round(self.rng.uniform(low, high), 1)
+        return [(0, {('mass-range-slider', 'value'): [start, round(self.rng.uniform(start, high), 1)]})]
+
+    def _map_style(self, props):
+        # only the style changes, the points on the map stay the same
+        options = option_values(props.get(('type-map', 'options')))
+        current = props.get(('type-map', 'value'))
+        return [(0, {('type-map', 'value'): self.rng.choice([o for o in options if o != current] or options)})]
+
+    def _map_move(self, props):
+        zoom = self.rng.uniform(0.5, 6)
+        lon, lat = self.rng.uniform(-170, 170), self.rng.uniform(-60, 60)
+        half_width, half_height = 180 / 2 ** zoom, 90 / 2 ** zoom
+        corners = [[lon - half_width, lat + half_height], [lon + half_width, lat + half_height],
+                   [lon + half_width, lat - half_height], [lon - half_width, lat - half_height]]
+        relayout = {'mapbox.center': {'lon': lon, 'lat': lat}, 'mapbox.zoom': zoom, 'mapbox.bearing': 0,
+                    'mapbox.pitch': 0, 'mapbox._derived': {'coordinates': corners}}
+        return [(0, {('graph-map', 'relayoutData'): relayout})]
+
+    def actions(self, props):
+        actions = [self._slider_drag, self._year_selection, self._map_move,
+                   lambda p: self._toggle(p, 'seen-found-check'),
+                   lambda p: self._toggle(p, 'graph-input'),
+                   lambda p: self._choose(p, 'chart-dropdown'),
+                   self._map_style]
+        if self._has(props, 'class-dropdown'):
+            actions.append(self._classes)
+        if self._has(props, 'nametype-check'):
+            actions.append(lambda p: self._toggle(p, 'nametype-check'))
+        if self._has(props, 'mass-range-slider'):
+            actions.append(self._mass)
+        return actions
+
+    def session(self, interactions=20, think=2.0):
+        props = copy.deepcopy(self.initial_props)
+        initial = [callback_body(callback, props, []) for callback in self.callbacks
+                   if not callback.get('prevent_initial_call')]
+        steps = [{'think': 0, 'requests': initial}]
+        actions = self.actions(props)
+        for _ in range(interactions):
+            action = self.rng.choice(actions)
+            for i, (pause, changes) in enumerate(action(props)):
+                requests = self._requests(props, changes)
+                if requests:
+                    steps.append({'think': self.rng.expovariate(1 / think) if i == 0 else pause,
+                                  'requests': requests})
+        return steps
+
+
+def read_recording(path):
+    """Sessions of a ``METEORITES_RECORD`` file, requests closer than ``STEP_GAP`` making one step."""
+    by_session = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                by_session[entry['session']].append(entry)
+
+    sessions = []
+    for entries in by_session.values():
+        entries.sort(key=lambda entry: entry['time'])
+        steps = []
+        last = None
+        for entry in entries:
+            gap = 0 if last is None else entry['time'] - last
+            if steps and gap < STEP_GAP:
+                steps[-1]['requests'].append(entry['body'])
+            else:
+                steps.append({'think': gap, 'requests': [entry['body']]})
+            last = entry['time']
+        sessions.append(steps)
+    return sessions
+
+
+def state_props(dependencies):
+    """``(id, property)`` read as state by a callback, which the browser sends from the answers it got."""
+    return {(item['id'], item['property']) for dep in dependencies for item in dep.get('state') or []}
+
+
+def with_state(body, state):
+    if not body.get('state'):
+        return body
+    return dict(body, state=[dict(item, value=state[item['id'], item['property']])
+                             if (item['id'], item['property']) in state else item for item in body['state']])
+
+
+def read_answer(response, data):
+    encoding = response.getheader('Content-Encoding')
+    if encoding == 'gzip':
+        data = gzip.decompress(data)
+    elif encoding == 'br':
+        import brotli
+
+        data = brotli.decompress(data)
+    return json.loads(data)
+
+
+def post(connection, body, background, answer=False):
+    """Status and, if ``answer``, answer of a callback request, polling a background callback until its result."""
+    payload = json.dumps(body)
+    if not background:
+        connection.request('POST', DASH_UPDATE, body=payload,
+                           headers={'Content-Type': 'application/json', 'Accept-Encoding': 'br, gzip'})
+        response = connection.getresponse()
+        data = response.read()
+        if answer and response.status == 200:
+            return response.status, read_answer(response, data)
+        return response.status, None
+
+    url = DASH_UPDATE
+    while True:
+        connection.request('POST', url, body=payload, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            return response.status, None
+        result = json.loads(data)
+        if 'cacheKey' in result:
+            url = f"{DASH_UPDATE}?cacheKey={result['cacheKey']}&job={result['job']}"
+        elif 'response' in result or url == DASH_UPDATE:
+            return response.status, result
+        else:
+            time.sleep(0.05)
+
+
+def virtual_user(port, sessions, background, tracked, deadline, think_scale, records, seed):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while time.monotonic() < deadline:
+        # a session is a page load, the state starts empty
+        state = {}
+        for step in rng.choice(sessions):
+            time.sleep(step['think'] * think_scale)
+            if time.monotonic() >= deadline:
+                break
+            for body in step['requests']:
+                outputs = body['outputs'] if isinstance(body['outputs'], list) else [body['outputs']]
+                wanted = any((output['id'], output['property']) in tracked for output in outputs)
+                start = time.perf_counter()
+                try:
+                    status, answer = post(connection, with_state(body, state), body['output'] in background,
+                                          wanted)
+                except (OSError, http.client.HTTPException, ValueError):
+                    status, answer = None, None
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                records.append((body['output'], time.perf_counter() - start, status))
+                for component_id, props in ((answer or {}).get('response') or {}).items():
+                    state.update({(component_id, name): value for name, value in props.items()
+                                  if (component_id, name) in tracked})
+    connection.close()
+
+
+def load(port, sessions, background, tracked, users, duration, think_scale, warmup):
+    """Run ``users`` virtual users for ``duration`` seconds, after ``warmup`` seconds that are not counted."""
+    records = []
+    start = time.monotonic()
+    threads = [threading.Thread(target=virtual_user,
+                                args=(port, sessions, background, tracked, start + warmup + duration,
+                                      think_scale, records, i))
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    counted_from = len(records)
+    measured_start = time.monotonic()
+    for thread in threads:
+        thread.join()
+    return records[counted_from:], time.monotonic() - measured_start
+
+
+def summarize(records, elapsed):
+    by_callback = defaultdict(list)
+    for output, latency, status in records:
+        by_callback[output].append((latency, status))
+        by_callback['all'].append((latency, status))
+
+    summary = {}
+    for output, entries in sorted(by_callback.items()):
+        latencies = np.array([latency for latency, _ in entries]) * 1000
+        errors = sum(1 for _, status in entries if status is None or status >= 400)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[output] = {
+            'requests': len(entries),
+            'throughput': len(entries) / elapsed,
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+            'error_rate': errors / len(entries),
+        }
+    return summary
+
+
+def print_summary(workers, users, summary):
+    print(f"\n{workers} workers, {users} users")
+    print(f"  {'callback':<26}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for output, row in summary.items():
+        print(f"  {output:<26}{row['requests']:>9}{row['throughput']:>9.1f}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['error_rate']:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=20, help="seconds measured per run")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds run before measuring")
+    parser.add_argument('--think', type=float, default=1.0, help="scale of the think times, 0 for none")
+    parser.add_argument('--recording', help="METEORITES_RECORD file to replay instead of generated sessions")
+    parser.add_argument('--sessions', type=int, default=50, help="number of generated sessions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help="environment of the server, e.g. METEORITES_RESPONSE_STORE=0")
+    parser.add_argument('--output', help="write the results to this json file")
+    args = parser.parse_args()
+
+    env = dict(item.split('=', 1) for item in args.env)
+    runs = []
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(workers, port, env)
+        try:
+            dependencies = get_json(f'http://127.0.0.1:{port}/_dash-dependencies')
+            # background callbacks (METEORITES_JOBS) answer with a job to poll
+            background = {dep['output'] for dep in dependencies if dep.get('long')}
+            tracked = state_props(dependencies)
+            if args.recording:
+                sessions = read_recording(args.recording)
+            else:
+                generator = SessionGenerator(get_json(f'http://127.0.0.1:{port}/_dash-layout'), dependencies,
+                                             args.seed)
+                sessions = [generator.session() for _ in range(args.sessions)]
+            for users in args.users:
+                records, elapsed = load(port, sessions, background, tracked, users, args.duration, args.think,
+                                        args.warmup)
+                summary = summarize(records, elapsed)
+                print_summary(workers, users, summary)
+                runs.append({'workers': workers, 'users': users, 'seconds': elapsed, 'callbacks': summary})
+        finally:
+            stop_server(server)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'env': env, 'runs': runs}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark of the query and figure functions on synthetic tables.
+
+Times ``get_filtered_df``, ``get_by_country``, ``get_by_other``,
+``get_by_years`` and the three figure callbacks on tables of 45k, 1M and 10M
+rows, over several slider ranges, meteorite types and dropdown values. Every
+call runs with an empty query cache. Peak memory is measured with
+tracemalloc in a separate run, payload is the JSON size of figures and the
+in-memory size of frames.
+
+    python benchmarks/run.py --sizes 45000 1000000 --output results.json
+    python benchmarks/run.py --sizes 45000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import plotly.io as pio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate  # noqa: E402
+
+SIZES = [45000, 1000000, 10000000]
+YEAR_RANGES = {'full': (1700, 2013), 'recent': (1990, 2013), 'decade': (1900, 1910), 'single': (2000, 2000)}
+FALLS = {'both': ['Found', 'Fell'], 'found': ['Found'], 'fell': ['Fell']}
+DROPDOWNS = ['Country', 'Population', 'Climate', 'Region']
+
+
+def import_app():
+    # app.py loads data/meteorites.csv at import, give it a small table from a scratch directory
+    os.environ.setdefault('mapbox_access_token', '')
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp()
+    os.makedirs(os.path.join(scratch, 'data'))
+    generate(1000).to_csv(os.path.join(scratch, 'data', 'meteorites.csv'), index=False)
+    os.chdir(scratch)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+def cases(app):
+    for range_name, years in YEAR_RANGES.items():
+        for fall_name, fall in FALLS.items():
+            label = f'{range_name}/{fall_name}'
+            yield 'get_filtered_df', label, lambda y=years, f=fall: app.get_filtered_df(y, f)
+            yield 'get_by_country', label, lambda y=years, f=fall: app.get_by_country(y, f)
+            yield 'get_by_years', label, lambda y=years, f=fall: app.get_by_years(y, f)
+            for xaxis in ['Climate', 'Region']:
+                yield 'get_by_other', f'{label}/{xaxis}', lambda y=years, f=fall, x=xaxis: app.get_by_other(y, f, x)
+            yield 'update_graph', label, lambda y=years, f=fall: app.update_graph(y, f, 'dark', None)
+            for dropdown in DROPDOWNS:
+                yield 'display_barchart', f'{label}/{dropdown}', \
+                    lambda y=years, f=fall, d=dropdown: app.display_barchart(d, y, f, [])
+            yield 'display_year_chart', label, lambda y=years, f=fall: app.display_year_chart(y, f)
+
+
+def payload_size(result):
+    if isinstance(result, dict):
+        return len(pio.json.to_json_plotly(result).encode())
+    if isinstance(result, tuple):
+        result = result[0]
+    return int(result.memory_usage(deep=True).sum())
+
+
+def measure(app, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        app.query_cache.clear()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    app.query_cache.clear()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'min_ms': timings[0] * 1000,
+        'peak_bytes': peak,
+        'payload_bytes': payload_size(result),
+    }
+
+
+def run(sizes, repeat):
+    from meteorites.data import MeteoriteData
+
+    app = import_app()
+    results = []
+    for rows in sizes:
+        df = generate(rows)
+        start = time.perf_counter()
+        app.dataset = MeteoriteData(df)
+        setup_ms = (time.perf_counter() - start) * 1000
+        print(f"{rows} rows, indexes built in {setup_ms:.0f} ms")
+        results.append({'rows': rows, 'function': 'MeteoriteData', 'case': 'build', 'median_ms': setup_ms})
+
+        for function, case, func in cases(app):
+            result = measure(app, func, repeat)
+            result.update(rows=rows, function=function, case=case)
+            results.append(result)
+            print(f"  {function:<20} {case:<28} {result['median_ms']:>9.2f} ms "
+                  f"{result['peak_bytes'] / 1e6:>8.1f} MB peak {result['payload_bytes']:>11} B")
+        del app.dataset, df
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    before = {(r['rows'], r['function'], r['case']): r for r in previous['results']}
+    print(f"\ncompared with {previous.get('revision')}:")
+    for result in results:
+        old = before.get((result['rows'], result['function'], result['case']))
+        if old is None or not old['median_ms']:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        flag = '  slower' if ratio > 1.2 else ''
+        print(f"  {result['rows']:>9} {result['function']:<20} {result['case']:<28} x{ratio:5.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--compare', help="json file of a previous run")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+    report = {
+        'revision': git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Response size and encode time of the default view, with and without typed arrays.
+
+Run from the repository root: ``python benchmarks/serialization.py``.
+"""
+import os
+import sys
+import time
+
+import plotly.io as pio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('mapbox_access_token', '')
+
+import app  # noqa: E402
+from meteorites import serialize  # noqa: E402
+
+REPEAT = 20
+
+
+def default_figures():
+    years = list(app.dataset.year_bounds())
+    fall = ['Found', 'Fell']
+    return {
+        'update_graph': lambda: app.update_graph(years, fall, 'dark', None),
+        'display_barchart': lambda: app.display_barchart('Country', years, fall, []),
+        'display_year_chart': lambda: app.display_year_chart(years, fall),
+    }
+
+
+def measure(build, typed_arrays, engine):
+    serialize.TYPED_ARRAYS = typed_arrays
+    # aggregations are cached, only the figure building and encoding are timed
+    build()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        body = pio.json.to_json_plotly(build(), engine=engine)
+    elapsed = (time.perf_counter() - start) / REPEAT
+    return len(body.encode()), elapsed
+
+
+def main():
+    print(f"{'callback':<20} {'mode':<20} {'bytes':>10} {'ms':>8}")
+    for name, build in default_figures().items():
+        for label, typed_arrays, engine in [('json lists', False, 'json'),
+                                            ('typed arrays+orjson', True, 'orjson')]:
+            size, elapsed = measure(build, typed_arrays, engine)
+            print(f"{name:<20} {label:<20} {size:>10} {elapsed * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Synthetic meteorite tables with the schema of data/meteorites.csv.
+
+The distributions roughly follow the real data: most landings after 1970,
+about 3% observed falls, a few hundred classes with a long tail, and points
+clustered around 227 countries.
+"""
+import numpy as np
+import pandas as pd
+
+REGIONS = ['ASIA (EX. NEAR EAST)', 'BALTICS', 'C.W. OF IND. STATES', 'EASTERN EUROPE', 'LATIN AMER. & CARIB',
+           'NEAR EAST', 'NORTHERN AFRICA', 'NORTHERN AMERICA', 'OCEANIA', 'SUB-SAHARAN AFRICA', 'WESTERN EUROPE']
+CLIMATES = ['Desert', 'Tropical', 'Temperate', 'Desert/Tropical', 'Tropical/Temperate', 'other']
+N_COUNTRIES = 227
+N_CLASSES = 450
+
+
+def countries(seed=0):
+    rng = np.random.default_rng(seed)
+    population = rng.integers(10 ** 4, 10 ** 9, N_COUNTRIES)
+    area = rng.integers(10, 2 * 10 ** 7, N_COUNTRIES)
+    return pd.DataFrame({
+        'ISO 3166-1 alpha-3': [f'C{i:02X}' for i in range(N_COUNTRIES)],
+        'Country': [f'Country {i}' for i in range(N_COUNTRIES)],
+        'Region': rng.choice(REGIONS, N_COUNTRIES),
+        'Population': population,
+        'Area (km sq)': area,
+        'Pop. Density (per sq. km.)': (population / area).round(1),
+        'GDP ($ per capita)': rng.integers(500, 55000, N_COUNTRIES).astype(np.float64),
+        'Climate': rng.choice(CLIMATES, N_COUNTRIES),
+        'lat': rng.uniform(-80, 75, N_COUNTRIES),
+        'lon': rng.uniform(-180, 180, N_COUNTRIES),
+    })
+
+
+def generate(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    table = countries(seed)
+
+    # a few countries (Antarctica, Oman, Libya...) hold most of the finds
+    weights = rng.pareto(1.2, N_COUNTRIES) + 0.01
+    country = rng.choice(N_COUNTRIES, rows, p=weights / weights.sum())
+    recent = rng.random(rows) < 0.8
+    year = np.where(recent, rng.integers(1970, 2014, rows), rng.integers(1700, 1970, rows))
+    class_weights = 1 / np.arange(1, N_CLASSES + 1)
+
+    df = pd.DataFrame({
+        'name': np.char.add('synthetic ', np.arange(rows).astype(str)).astype(object),
+        'id': np.arange(rows),
+        'nametype': np.where(rng.random(rows) < 0.999, 'Valid', 'Relict').astype(object),
+        'recclass': np.char.add('class ', rng.choice(N_CLASSES, rows, p=class_weights / class_weights.sum())
+                                .astype(str)).astype(object),
+        'mass (g)': rng.lognormal(3, 2.5, rows).round(2),
+        'fall': np.where(rng.random(rows) < 0.03, 'Fell', 'Found').astype(object),
+        'year': year,
+        'reclat': np.clip(table['lat'].to_numpy()[country] + rng.normal(0, 3, rows), -90, 90).round(5),
+        'reclong': ((table['lon'].to_numpy()[country] + rng.normal(0, 3, rows) + 180) % 360 - 180).round(5),
+    })
+    for column in ['ISO 3166-1 alpha-3', 'Country', 'Region', 'Population', 'Area (km sq)',
+                   'Pop. Density (per sq. km.)', 'GDP ($ per capita)', 'Climate']:
+        df[column] = table[column].to_numpy()[country]
+    return df.sort_values(by=['year'], kind='mergesort', ignore_index=True)
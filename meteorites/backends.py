@@ -0,0 +1,367 @@
+"""Query backends and their selection.
+
+``METEORITES_BACKEND`` picks the engine behind the query functions of the
+app:
+
+- ``pandas`` (default): the whole table in memory with its indexes and
+  count cube, see ``meteorites.data.MeteoriteData``.
+- ``duckdb``: DuckDB scans of ``data/meteorites.parquet``, for tables larger
+  than memory. The year/fall/viewport predicates and the group-bys run in
+  the engine, and the year-sorted Parquet row groups let it skip whole
+  blocks outside the year range. Needs the ``duckdb`` package.
+
+Both return the same frames. The Parquet file records the CSV it was built
+from, like the snapshot; when it is missing or stale the DuckDB backend
+scans the CSV instead. Build the Parquet file and check the two backends
+against each other with::
+
+    python -m meteorites.backends --build-parquet
+    python -m meteorites.backends --verify
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from meteorites.bitmaps import MASS_COLUMN, make_filters
+from meteorites.cube import COUNTRY_COLUMNS, cell_positions, export_counts, export_frames, year_count_matrix
+from meteorites.data import BATCH_DIR, MAP_COLUMNS, VERSION_FILE, folded, load_data, read_version
+from meteorites.snapshot import CSV_PATH, is_stale, source_info
+
+BACKEND = os.environ.get('METEORITES_BACKEND', 'pandas')
+PARQUET_PATH = 'data/meteorites.parquet'
+SOURCE_KEY = 'meteorites_source'
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def build_parquet(csv_path=CSV_PATH, parquet_path=PARQUET_PATH, row_group_size=100000, batches=()):
+    """Write the Parquet file of ``csv_path``, recording the ingested ``batches`` the csv already holds."""
+    import duckdb
+
+    # the source of the csv goes in the file metadata, see parquet_is_stale
+    source = json.dumps(dict(source_info(csv_path), batches=list(batches)))
+    # write next to the file and swap it in, a worker never opens half a file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(parquet_path) or '.', suffix='.parquet.tmp')
+    os.close(fd)
+    con = duckdb.connect()
+    con.execute(f"COPY (SELECT * FROM read_csv_auto(?, header=true) ORDER BY year) "
+                f"TO {_literal(tmp_path)} (FORMAT PARQUET, ROW_GROUP_SIZE {int(row_group_size)}, "
+                f"KV_METADATA {{{SOURCE_KEY}: {_literal(source)}}})", [csv_path])
+    os.replace(tmp_path, parquet_path)
+    return con.execute("SELECT count(*) FROM read_parquet(?)", [parquet_path]).fetchone()[0]
+
+
+def parquet_source(parquet_path=PARQUET_PATH):
+    """Source info of the csv the Parquet file was built from and the batches it holds, None if unknown."""
+    import duckdb
+
+    if not os.path.exists(parquet_path):
+        return None
+    try:
+        rows = duckdb.connect().execute("SELECT value FROM parquet_kv_metadata(?) WHERE key = ?",
+                                        [parquet_path, SOURCE_KEY]).fetchall()
+        return json.loads(rows[0][0]) if rows else None
+    except (duckdb.Error, ValueError):
+        return None
+
+
+def parquet_is_stale(parquet_path=PARQUET_PATH, csv_path=CSV_PATH):
+    if not os.path.exists(csv_path):
+        # the parquet file is all we have
+        return not os.path.exists(parquet_path)
+    source = parquet_source(parquet_path)
+    return is_stale({'source': source} if source is not None else None, csv_path)
+
+
+class DuckDBBackend:
+    """Out-of-core query backend on a year-sorted Parquet file, or on the csv itself."""
+
+    def __init__(self, path=PARQUET_PATH, version=0, batches=(), batch_dir=BATCH_DIR, identity='duckdb',
+                 folded=()):
+        import duckdb
+
+        self.path = path
+        self.version = version
+        self.identity = identity
+        self.batches = list(batches)
+        # the first batches, already in the file
+        self.folded = list(folded)
+        self.batch_dir = batch_dir
+        self.con = duckdb.connect()
+        if path.endswith('.csv'):
+            source = "SELECT * FROM read_csv_auto(?, header=true)"
+        else:
+            source = "SELECT * FROM read_parquet(?)"
+        source = self._inline(source, [path])
+        scanned = self.batches[len(self.folded):]
+        if scanned:
+            # ingested batches are scanned from their csv until they are compacted, with the column types of
+            # the table: the few rows of a batch would give their own (a blank column as VARCHAR)
+            columns = self.con.execute(f"DESCRIBE {source}").fetchall()
+            types = '{' + ', '.join(f'{_literal(name)}: {_literal(kind)}' for name, kind, *_ in columns) + '}'
+            source += self._inline(" UNION ALL BY NAME SELECT * FROM read_csv_auto(?, header=true, ",
+                                   [[os.path.join(batch_dir, name) for name in scanned]]) + f"types={types})"
+        self.con.execute(f"CREATE VIEW meteorites AS {source}")
+
+    @staticmethod
+    def _inline(sql, params):
+        # views cannot take prepared parameters
+        for param in params:
+            if isinstance(param, list):
+                literal = '[' + ', '.join(_literal(p) for p in param) + ']'
+            else:
+                literal = _literal(param)
+            sql = sql.replace('?', literal, 1)
+        return sql
+
+    def append(self, names, version, batch_dir=BATCH_DIR):
+        return DuckDBBackend(self.path, version, self.batches + list(names), batch_dir, self.identity, self.folded)
+
+    def _execute(self, sql, params=()):
+        # a cursor per query, the connection is shared by the threads of the worker
+        params = [p.item() if isinstance(p, np.generic) else p for p in params]
+        return self.con.cursor().execute(sql, params)
+
+    def _query(self, sql, params=()):
+        return self._execute(sql, params).df()
+
+    @staticmethod
+    def _in(column, values):
+        values = list(dict.fromkeys(values))
+        if not values:
+            return " AND false", []
+        return f" AND {_quote(column)} IN (" + ', '.join('?' * len(values)) + ")", values
+
+    @classmethod
+    def _where(cls, years, fall, filters=None):
+        clause, params = cls._in('fall', fall)
+        clause = "year >= ? AND year <= ?" + clause
+        params = [years[0], years[1]] + params
+        if filters is not None:
+            recclass, nametype, mass = filters
+            for column, values in (('recclass', recclass), ('nametype', nametype)):
+                if values is not None:
+                    more, values = cls._in(column, values)
+                    clause += more
+                    params += values
+            if mass is not None:
+                if mass[0] is not None:
+                    clause += f" AND {_quote(MASS_COLUMN)} >= ?"
+                    params.append(mass[0])
+                if mass[1] is not None:
+                    clause += f" AND {_quote(MASS_COLUMN)} <= ?"
+                    params.append(mass[1])
+        return clause, params
+
+    def year_bounds(self):
+        return tuple(self.con.cursor().execute("SELECT min(year), max(year) FROM meteorites").fetchone())
+
+    def values(self, column):
+        return self._query(f"SELECT DISTINCT {_quote(column)} AS value FROM meteorites "
+                           f"WHERE {_quote(column)} IS NOT NULL ORDER BY value")['value'].tolist()
+
+    def mass_bounds(self):
+        mass = _quote(MASS_COLUMN)
+        return tuple(self.con.cursor().execute(
+            f"SELECT min({mass}) FILTER (WHERE {mass} > 0), max({mass}) FROM meteorites").fetchone())
+
+    def filtered(self, years, fall, filters=None):
+        where, params = self._where(years, fall, filters)
+        return self._query(f"SELECT * FROM meteorites WHERE {where} ORDER BY year", params)
+
+    def iter_filtered(self, years, fall, filters=None, chunk_rows=50000):
+        where, params = self._where(years, fall, filters)
+        import duckdb
+
+        cursor = self._execute(f"SELECT * FROM meteorites WHERE {where} ORDER BY year", params)
+        # frames of whole vectors of the engine, without going through pyarrow
+        vectors = max(1, chunk_rows // duckdb.__standard_vector_size__)
+        frame = cursor.fetch_df_chunk(vectors)
+        # the first frame is sent even when empty, it has the columns
+        yield frame
+        while len(frame):
+            frame = cursor.fetch_df_chunk(vectors)
+            if len(frame):
+                yield frame
+
+    def map_frame(self, years, fall, bbox=None, filters=None):
+        where, params = self._where(years, fall, filters)
+        if bbox is not None:
+            west, south, east, north = bbox
+            where += " AND reclat >= ? AND reclat <= ?"
+            params += [south, north]
+            if east > 180:
+                where += " AND (reclong >= ? OR reclong <= ?)"
+                params += [west, east - 360]
+            else:
+                where += " AND reclong >= ? AND reclong <= ?"
+                params += [west, east]
+        columns = ', '.join(_quote(c) for c in MAP_COLUMNS)
+        return self._query(f"SELECT {columns} FROM meteorites WHERE {where} ORDER BY year", params)
+
+    def _country_counts(self, years, fall, filters=None):
+        where, params = self._where(years, fall, filters)
+        keys = ', '.join(_quote(c) for c in COUNTRY_COLUMNS)
+        not_null = ' AND '.join(f'{_quote(c)} IS NOT NULL' for c in COUNTRY_COLUMNS)
+        return (f"SELECT {keys}, fall, count(*) AS count FROM meteorites "
+                f"WHERE {where} AND {not_null} GROUP BY {keys}, fall"), params
+
+    def by_country(self, years, fall, filters=None):
+        sql, params = self._country_counts(years, fall, filters)
+        df_by_country = self._query(sql, params)
+        df_by_country.sort_values(by='count', inplace=True)
+        df_by_country['density'] = df_by_country['count'] / df_by_country['Area (km sq)']
+        return df_by_country
+
+    def by_other(self, years, fall, xaxis, filters=None):
+        sql, params = self._country_counts(years, fall, filters)
+        df_other = self._query(
+            f"WITH countries AS ({sql}) SELECT {_quote(xaxis)}, fall, sum(count) AS count, "
+            f"sum({_quote('Area (km sq)')}) AS {_quote('Area (km sq)')} FROM countries "
+            f"GROUP BY {_quote(xaxis)}, fall", params)
+        df_other.sort_values(by='count', inplace=True)
+        df_other['density'] = df_other['count'] / df_other['Area (km sq)']
+        return df_other
+
+    def by_years(self, years, fall, filters=None):
+        where, params = self._where(years, fall, filters)
+        return self._query(f"SELECT year, fall, count(name) AS count FROM meteorites WHERE {where} "
+                           f"GROUP BY year, fall HAVING count(name) > 0 ORDER BY year, fall", params)
+
+    def export(self, filters=None):
+        """The aggregates of ``CountCube.export``, counted by the engine."""
+        if filters is None:
+            where, params = "true", []
+        else:
+            where, params = self._where(self.year_bounds(), self.values('fall'), filters)
+        keys = ', '.join(_quote(c) for c in COUNTRY_COLUMNS)
+        has_country = ' AND '.join(f'{_quote(c)} IS NOT NULL' for c in COUNTRY_COLUMNS)
+        located = f"{where} AND year IS NOT NULL AND fall IS NOT NULL"
+
+        years = self._query(f"SELECT DISTINCT year FROM meteorites WHERE {where} AND year IS NOT NULL "
+                            f"ORDER BY year", params)['year']
+        fall_values = self._query(f"SELECT DISTINCT fall FROM meteorites WHERE {where} AND fall IS NOT NULL "
+                                  f"ORDER BY fall", params)['fall']
+        countries = self._query(f"SELECT DISTINCT {keys} FROM meteorites WHERE {where} AND {has_country}", params)
+        cells = self._query(f"SELECT year, fall, {keys}, count(*) AS count FROM meteorites "
+                            f"WHERE {located} AND {has_country} GROUP BY year, fall, {keys}", params)
+        named = self._query(f"SELECT year, fall, count(name) AS count FROM meteorites WHERE {located} "
+                            f"GROUP BY year, fall", params)
+
+        years, fall_values = years.to_numpy(), fall_values.to_numpy()
+        return export_counts(years, fall_values, countries, cell_positions(years, fall_values, countries, cells),
+                             year_count_matrix(years, fall_values, named))
+
+
+def load_duckdb(parquet_path=PARQUET_PATH, csv_path=CSV_PATH, version_file=VERSION_FILE, batch_dir=BATCH_DIR):
+    info = read_version(version_file)
+    if parquet_is_stale(parquet_path, csv_path):
+        print("meteorites parquet missing or stale, scanning the csv")
+        path, digest, included = csv_path, source_info(csv_path)['sha256'], []
+    else:
+        source = parquet_source(parquet_path) or {}
+        path, digest, included = parquet_path, source.get('sha256', 'unknown'), source.get('batches', [])
+    # a compaction stopped before VERSION.json was written still lists the batches it folded
+    return DuckDBBackend(path, info['version'], info['batches'], batch_dir, identity=f'duckdb:{digest}',
+                         folded=folded(info['batches'], included))
+
+
+LOADERS = {
+    'pandas': load_data,
+    'duckdb': load_duckdb,
+}
+
+
+def backend_loader(name=BACKEND):
+    try:
+        loader = LOADERS[name]
+    except KeyError:
+        raise ValueError(f"unknown backend {name!r}, expected one of {', '.join(LOADERS)}")
+    return loader
+
+
+def _normalize(df):
+    # compact dtypes (categoricals, int16, float32) compare with the full ones
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        if df[column].dtype.kind in 'iuf':
+            df[column] = df[column].astype(np.float64)
+        else:
+            df[column] = df[column].astype(object)
+    return df.sort_values(by=list(df.columns), kind='mergesort', ignore_index=True)
+
+
+def verify(reference, candidate, year_ranges=None, falls=None, xaxes=None, filter_sets=None):
+    """Compare every query of two backends, return the list of mismatching cases."""
+    low, high = reference.year_bounds()
+    year_ranges = year_ranges or [(low, high), (1900, 1950), (2000, 2000), (high + 1, high + 10)]
+    falls = falls or [['Found', 'Fell'], ['Fell'], ['Found'], []]
+    xaxes = xaxes or ['Climate', 'Region']
+    filter_sets = filter_sets or [
+        None,
+        make_filters(recclass=reference.values('recclass')[:3]),
+        make_filters(nametype=reference.values('nametype')[:1], mass=(10, 1000)),
+        make_filters(recclass=reference.values('recclass')[::2], mass=(None, 50)),
+    ]
+    bboxes = [None, (-20.0, -40.0, 60.0, 40.0), (170.0, -60.0, 200.0, 10.0)]
+
+    failures = []
+
+    def check(name, expected, actual):
+        if set(expected.columns) < set(actual.columns):
+            # the compact table leaves out the columns no callback reads
+            actual = actual[list(expected.columns)]
+        try:
+            pd.testing.assert_frame_equal(_normalize(expected), _normalize(actual), check_dtype=False,
+                                          check_exact=False)
+        except AssertionError as error:
+            failures.append((name, str(error).splitlines()[0]))
+
+    for filters in filter_sets:
+        for name, expected, actual in zip(['cells', 'year_counts'], export_frames(reference.export(filters)),
+                                          export_frames(candidate.export(filters))):
+            check(f'export {name} {filters}', expected, actual)
+
+    for years in year_ranges:
+        for fall in falls:
+            for filters in filter_sets:
+                case = f'{years} {fall} {filters}'
+                check(f'filtered {case}', reference.filtered(years, fall, filters),
+                      candidate.filtered(years, fall, filters))
+                check(f'by_country {case}', reference.by_country(years, fall, filters),
+                      candidate.by_country(years, fall, filters))
+                check(f'by_years {case}', reference.by_years(years, fall, filters),
+                      candidate.by_years(years, fall, filters))
+                for xaxis in xaxes:
+                    check(f'by_other {case} {xaxis}', reference.by_other(years, fall, xaxis, filters),
+                          candidate.by_other(years, fall, xaxis, filters))
+                for bbox in bboxes:
+                    check(f'map_frame {case} {bbox}', reference.map_frame(years, fall, bbox, filters),
+                          candidate.map_frame(years, fall, bbox, filters))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build and check the query backends")
+    parser.add_argument('--build-parquet', action='store_true', help=f"write {PARQUET_PATH} from {CSV_PATH}")
+    parser.add_argument('--verify', action='store_true', help="compare the duckdb backend with the pandas one")
+    args = parser.parse_args()
+    if args.build_parquet:
+        print(f"wrote {build_parquet()} rows to {PARQUET_PATH}")
+    if args.verify:
+        failures = verify(load_data(), load_duckdb())
+        for name, message in failures:
+            print(f"{name}: {message}")
+        print(f"{len(failures)} mismatching queries")
+        sys.exit(1 if failures else 0)
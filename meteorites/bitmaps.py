@@ -0,0 +1,131 @@
+"""Bitmap indexes for the class, name type and mass filters.
+
+Every row of the year-sorted table is one bit. Each ``recclass`` and
+``nametype`` value keeps the rows it covers, as a packed bitmap when it is
+frequent or as a sorted array of positions when that is smaller, like the
+containers of a Roaring bitmap. ``mass (g)`` is indexed by its sort order, so
+a mass range is two binary searches. A combination of filters is the AND of
+their bitmaps, applied to the rows picked by the year and fall index by
+testing their bits only.
+"""
+import functools
+
+import numpy as np
+import pandas as pd
+
+BITMAP_COLUMNS = ['recclass', 'nametype']
+MASS_COLUMN = 'mass (g)'
+
+
+def make_filters(recclass=None, nametype=None, mass=None):
+    """``(recclass, nametype, mass)`` for the query functions, or None when none of them restricts the rows.
+
+    ``recclass`` and ``nametype`` are lists of the values to keep, None (or an empty ``recclass``) keeping them all.
+    ``mass`` is a ``(low, high)`` range in grams, an end being None when open.
+    """
+    recclass = tuple(sorted(set(recclass))) if recclass else None
+    nametype = tuple(sorted(set(nametype))) if nametype is not None else None
+    if mass is not None and mass[0] is None and mass[1] is None:
+        mass = None
+    if recclass is None and nametype is None and mass is None:
+        return None
+    return recclass, nametype, tuple(mass) if mass is not None else None
+
+
+def to_bitmap(positions, n):
+    bits = np.zeros(n, dtype=bool)
+    bits[positions] = True
+    return np.packbits(bits)
+
+
+def test_bits(bitmap, positions):
+    # packbits puts the first row in the high bit of each byte
+    return (bitmap[positions >> 3] >> (7 - (positions & 7))) & 1 == 1
+
+
+class ValueBitmaps:
+
+    def __init__(self, values):
+        self.n = len(values)
+        codes, categories = pd.factorize(values, sort=True)
+        self.codes = {value: i for i, value in enumerate(categories)}
+
+        located = np.flatnonzero(codes >= 0)
+        order = located[np.argsort(codes[located], kind='stable')]
+        offsets = np.zeros(len(categories) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes[located], minlength=len(categories)), out=offsets[1:])
+
+        self.bitmaps = {}
+        self.positions = {}
+        for code in range(len(categories)):
+            rows = order[offsets[code]:offsets[code + 1]]
+            # 4 bytes per position against n / 8 bytes for the bitmap
+            if len(rows) * 32 >= self.n:
+                self.bitmaps[code] = to_bitmap(rows, self.n)
+            else:
+                self.positions[code] = rows.astype(np.int32)
+
+    def select(self, values):
+        """Bitmap of the rows holding one of ``values``."""
+        bitmap = np.zeros((self.n + 7) // 8, dtype=np.uint8)
+        rare = []
+        for value in values:
+            code = self.codes.get(value)
+            if code is None:
+                continue
+            if code in self.bitmaps:
+                bitmap |= self.bitmaps[code]
+            else:
+                rare.append(self.positions[code])
+        if rare:
+            bitmap |= to_bitmap(np.concatenate(rare), self.n)
+        return bitmap
+
+
+class MassIndex:
+
+    def __init__(self, mass):
+        self.n = len(mass)
+        located = np.flatnonzero(np.isfinite(mass))
+        self.order = located[np.argsort(mass[located], kind='stable')]
+        self.sorted = mass[self.order]
+
+    def select(self, low, high):
+        """Bitmap of the rows with a mass in ``[low, high]``, None leaving that end open."""
+        start = 0 if low is None else np.searchsorted(self.sorted, low, side='left')
+        stop = len(self.sorted) if high is None else np.searchsorted(self.sorted, high, side='right')
+        return to_bitmap(self.order[start:stop], self.n)
+
+
+class FilterIndex:
+
+    def __init__(self, df):
+        self.n = len(df)
+        self.columns = {column: ValueBitmaps(df[column].to_numpy()) for column in BITMAP_COLUMNS}
+        self.mass = MassIndex(df[MASS_COLUMN].to_numpy(dtype=np.float64))
+        # a slider move keeps the same filters, their bitmap is reused
+        self.bitmap = functools.lru_cache(maxsize=32)(self._bitmap)
+
+    def _bitmap(self, filters):
+        recclass, nametype, mass = filters
+        parts = []
+        if recclass is not None:
+            parts.append(self.columns['recclass'].select(recclass))
+        if nametype is not None:
+            parts.append(self.columns['nametype'].select(nametype))
+        if mass is not None:
+            parts.append(self.mass.select(*mass))
+        return functools.reduce(np.bitwise_and, parts)
+
+    def restrict(self, positions, filters):
+        """Sorted positions, out of a slice or a sorted array of them, of the rows passing ``filters``."""
+        bitmap = self.bitmap(filters)
+        if isinstance(positions, slice):
+            start, stop = positions.start, positions.stop
+            if stop <= start:
+                return np.empty(0, dtype=np.int64)
+            first = start >> 3 << 3
+            bits = np.unpackbits(bitmap[start >> 3:(stop + 7) >> 3])
+            return np.flatnonzero(bits[start - first:stop - first]) + start
+        positions = np.asarray(positions, dtype=np.int64)
+        return positions[test_bits(bitmap, positions)]
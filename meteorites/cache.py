@@ -0,0 +1,179 @@
+"""Memoized query cache shared by the figure callbacks.
+
+One slider move fires ``update_graph``, ``display_barchart`` and
+``display_year_chart`` with the same ``(years, fall)``; with the cache only
+the first one computes. Entries live in a bounded in-process LRU with an
+optional TTL. When ``METEORITES_CACHE_DIR`` is set, entries are also pickled
+to that directory so every gunicorn worker on the machine shares them.
+
+Keys hold the identity of the dataset (backend, table layout and sha256 of
+the csv) and its ingest version, so workers on other data, or a restart on a
+rebuilt csv, never read each other's entries.
+
+Cached values are shared between callers and must not be modified in place.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize(value):
+    """Hashable, canonical form of callback inputs."""
+    if isinstance(value, (list, tuple)):
+        items = tuple(normalize(v) for v in value)
+        if items and all(isinstance(v, str) for v in items):
+            # checklist values, the order they were clicked in does not matter
+            return tuple(sorted(set(items)))
+        return items
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class DiskBackend:
+    """Pickled entries in a local directory, shared by the processes of the machine."""
+
+    def __init__(self, directory, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key, ttl=None):
+        path = self._path(key)
+        try:
+            if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        return value
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._prune()
+
+    def _prune(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pkl')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+class QueryCache:
+
+    def __init__(self, maxsize=256, ttl=None, backend=None):
+        # part of every key: what the data was loaded from, and its ingest version
+        self.dataset = None
+        self.version = 0
+        # or a function returning both, for data bound to each request
+        self.data_key = None
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    @classmethod
+    def from_env(cls):
+        ttl = os.environ.get('METEORITES_CACHE_TTL')
+        directory = os.environ.get('METEORITES_CACHE_DIR')
+        return cls(
+            maxsize=int(os.environ.get('METEORITES_CACHE_SIZE', 256)),
+            ttl=float(ttl) if ttl else None,
+            backend=DiskBackend(directory) if directory else None,
+        )
+
+    def get(self, key):
+        """Return ``(found, value)``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+
+        if self.backend is not None:
+            value = self.backend.get(key, self.ttl)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return True, value
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'shared_hits': self.shared_hits,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def memoize(self, func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            data_key = self.data_key() if self.data_key is not None else (self.dataset, self.version)
+            key = (func.__name__,) + data_key + tuple(normalize(arg) for arg in args)
+            found, value = self.get(key)
+            if not found:
+                value = func(*args)
+                self.set(key, value)
+            return value
+
+        return wrapper
@@ -0,0 +1,81 @@
+"""Compact in-memory representation of the meteorite table.
+
+With ``METEORITES_COMPACT=1`` the table is loaded with its low-cardinality
+text columns as categoricals (built straight from the snapshot codes), the
+year as int16 and the coordinates as float32, and without the columns no
+callback reads. Grouping then runs on the category codes.
+
+``python -m meteorites.compact`` prints the bytes per row of every column
+before and after.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from meteorites.bitmaps import MASS_COLUMN
+from meteorites.cube import COUNTRY_COLUMNS
+from meteorites.snapshot import CSV_PATH, SNAPSHOT_DIR, load_meteorites, load_table
+
+ENABLED = os.environ.get('METEORITES_COMPACT') == '1'
+CATEGORY_COLUMNS = ['fall', 'Country', 'ISO 3166-1 alpha-3', 'Region', 'Climate', 'recclass', 'nametype']
+FLOAT32_COLUMNS = ['reclat', 'reclong']
+USED_COLUMNS = ['name', 'fall', 'year', 'recclass', 'nametype', MASS_COLUMN] + FLOAT32_COLUMNS + COUNTRY_COLUMNS
+
+
+def narrow_year(year):
+    info = np.iinfo(np.int16)
+    if year.notna().all() and (year.empty or info.min <= year.min() and year.max() <= info.max):
+        return year.astype(np.int16)
+    return year.astype(np.float32)
+
+
+def compact(df, drop_name=True):
+    df = df[[column for column in df.columns if column in USED_COLUMNS]]
+    if drop_name and 'name' in df.columns and df['name'].notna().all():
+        # only counted for the rows that have one, see CountCube
+        df = df.drop(columns='name')
+    columns = {}
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = df[column].astype('category')
+        elif column in FLOAT32_COLUMNS:
+            columns[column] = df[column].astype(np.float32)
+        elif column == 'year':
+            columns[column] = narrow_year(df[column])
+        else:
+            columns[column] = df[column]
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_compact_table(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """``(table, batches)`` of ``snapshot.load_table``, with the table compacted."""
+    df, batches = load_table(csv_path, snapshot_dir, categorical=CATEGORY_COLUMNS)
+    return compact(df), batches
+
+
+def load_compact(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR):
+    return load_compact_table(csv_path, snapshot_dir)[0]
+
+
+def bytes_per_row(df):
+    return df.memory_usage(index=False, deep=True) / max(len(df), 1)
+
+
+def memory_report(before, after):
+    before_usage, after_usage = bytes_per_row(before), bytes_per_row(after)
+    lines = [f"{'column':<28}{'before':>10}{'after':>10}"]
+    for column, size in before_usage.items():
+        after_size = f'{after_usage[column]:.1f}' if column in after_usage else 'dropped'
+        lines.append(f"{column:<28}{size:>10.1f}{after_size:>10}")
+    lines.append(f"{'bytes per row':<28}{before_usage.sum():>10.1f}{after_usage.sum():>10.1f}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report the memory of the meteorite table, full and compact")
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--snapshot', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    print(memory_report(load_meteorites(args.csv, args.snapshot, categorical=False), load_compact(args.csv, args.snapshot)))
@@ -0,0 +1,154 @@
+"""Prefix-sum count cube for the bar and year charts.
+
+Counts are precomputed on a (year, fall, country) grid and accumulated along
+the year axis, so the counts for any ``[y0, y1]`` slider range are the
+difference of two slices: O(#countries) whatever the number of meteorites.
+The country attributes (Region, Climate, Population, ...) are joined back
+from a small table with one row per country.
+"""
+import numpy as np
+import pandas as pd
+
+COUNTRY_COLUMNS = ['Country', 'ISO 3166-1 alpha-3', 'Population', 'Area (km sq)', 'Pop. Density (per sq. km.)',
+                   'GDP ($ per capita)', 'Climate', 'Region']
+
+
+def named(df):
+    # a compact table drops the name column when every row has one
+    if 'name' not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return df['name'].notna().to_numpy()
+
+
+def export_counts(years, fall_values, countries, cells, year_counts):
+    """JSON-ready aggregates of the clientside charts.
+
+    ``cells`` holds the year, fall and country positions and the count of the non-zero cells, in that order,
+    ``year_counts`` the counts of named meteorites per year and fall.
+    """
+    return {
+        'years': years.tolist(),
+        'fall': fall_values.tolist(),
+        'countries': {column: countries[column].tolist() for column in COUNTRY_COLUMNS},
+        'cells': {name: values.tolist() for name, values in zip(['year', 'fall', 'country', 'count'], cells)},
+        'year_counts': year_counts.tolist(),
+    }
+
+
+def export_frames(export):
+    """The cells and year counts of an export as frames of values, whatever the order of its countries."""
+    cells = pd.DataFrame(export['cells'])
+    countries = pd.DataFrame(export['countries'], columns=COUNTRY_COLUMNS)
+    df_cells = countries.iloc[cells['country']].reset_index(drop=True)
+    df_cells['year'] = [export['years'][i] for i in cells['year']]
+    df_cells['fall'] = [export['fall'][i] for i in cells['fall']]
+    df_cells['count'] = cells['count']
+    df_years = pd.DataFrame(export['year_counts'], index=pd.Index(export['years'], name='year'),
+                            columns=pd.Index(export['fall'], name='fall'), dtype=np.int64)
+    return df_cells, df_years.stack().rename('count').reset_index()
+
+
+def cell_positions(years, fall_values, countries, cells):
+    """Positions and counts of a frame of (year, fall, country, count) cells for ``export_counts``, in cube order."""
+    year_pos = pd.Index(years).get_indexer(cells['year'])
+    fall_pos = pd.Index(fall_values).get_indexer(cells['fall'])
+    country_pos = pd.MultiIndex.from_frame(countries[COUNTRY_COLUMNS]).get_indexer(
+        pd.MultiIndex.from_frame(cells[COUNTRY_COLUMNS]))
+    # the order of np.nonzero on the cube
+    order = np.lexsort((country_pos, fall_pos, year_pos))
+    return year_pos[order], fall_pos[order], country_pos[order], cells['count'].to_numpy()[order]
+
+
+def year_count_matrix(years, fall_values, year_counts):
+    """Frame of year, fall and count as the (year, fall) matrix of ``export_counts``."""
+    matrix = year_counts.pivot_table(index='year', columns='fall', values='count', aggfunc='sum', fill_value=0)
+    return matrix.reindex(index=years, columns=fall_values, fill_value=0).to_numpy(dtype=np.int64)
+
+
+def merge_exports(export, more):
+    """Export of the rows counted by two exports."""
+    (cells, year_counts), (more_cells, more_year_counts) = export_frames(export), export_frames(more)
+    cells = pd.concat([cells, more_cells], ignore_index=True).groupby(
+        ['year', 'fall'] + COUNTRY_COLUMNS, sort=False)['count'].sum().reset_index()
+    years = np.array(sorted(set(export['years']) | set(more['years'])))
+    fall_values = np.array(sorted(set(export['fall']) | set(more['fall'])), dtype=object)
+    countries = pd.concat([pd.DataFrame(export['countries'], columns=COUNTRY_COLUMNS),
+                           pd.DataFrame(more['countries'], columns=COUNTRY_COLUMNS)],
+                          ignore_index=True).drop_duplicates(ignore_index=True)
+    return export_counts(years, fall_values, countries, cell_positions(years, fall_values, countries, cells),
+                         year_count_matrix(years, fall_values, pd.concat([year_counts, more_year_counts])))
+
+
+class CountCube:
+
+    def __init__(self, df):
+        year_codes, self.years = pd.factorize(df['year'], sort=True)
+        fall_codes, fall_values = pd.factorize(df['fall'], sort=True)
+        self.fall_values = np.asarray(fall_values, dtype=object)
+        self.fall_codes = {value: i for i, value in enumerate(self.fall_values)}
+
+        # rows with a missing country attribute are dropped, like the groupby they replace
+        keys = df[COUNTRY_COLUMNS]
+        has_country = keys.notna().all(axis=1).to_numpy()
+        grouped = keys[has_country].groupby(COUNTRY_COLUMNS, sort=False, observed=True)
+        country_codes = np.full(len(df), -1)
+        country_codes[has_country] = grouped.ngroup().to_numpy()
+        self.countries = grouped.size().index.to_frame(index=False)
+
+        counts, self.year_counts = self._count(year_codes, fall_codes, country_codes, named(df))
+        self.cumulative = np.zeros((len(self.years) + 1,) + counts.shape[1:], dtype=np.int64)
+        np.cumsum(counts, axis=0, out=self.cumulative[1:])
+
+    def _count(self, year_codes, fall_codes, country_codes, named):
+        n_years, n_fall, n_countries = len(self.years), len(self.fall_values), len(self.countries)
+
+        valid = (year_codes >= 0) & (fall_codes >= 0) & (country_codes >= 0)
+        flat = (year_codes[valid] * n_fall + fall_codes[valid]) * n_countries + country_codes[valid]
+        counts = np.bincount(flat, minlength=n_years * n_fall * n_countries).reshape(n_years, n_fall, n_countries)
+
+        # the year chart counts every named meteorite, with or without a country
+        valid = (year_codes >= 0) & (fall_codes >= 0) & named
+        flat = year_codes[valid] * n_fall + fall_codes[valid]
+        year_counts = np.bincount(flat, minlength=n_years * n_fall).reshape(n_years, n_fall)
+        return counts, year_counts
+
+    def _range(self, years):
+        start = int(np.searchsorted(self.years, years[0], side='left'))
+        stop = int(np.searchsorted(self.years, years[1], side='right'))
+        return start, max(start, stop)
+
+    def _fall_index(self, fall):
+        return np.array([self.fall_codes[value] for value in dict.fromkeys(fall) if value in self.fall_codes],
+                        dtype=np.intp)
+
+    def by_country(self, years, fall):
+        start, stop = self._range(years)
+        fall_index = self._fall_index(fall)
+        counts = self.cumulative[stop, fall_index] - self.cumulative[start, fall_index]
+
+        fall_pos, country_pos = np.nonzero(counts)
+        df_by_country = self.countries.take(country_pos).reset_index(drop=True)
+        df_by_country['fall'] = self.fall_values[fall_index[fall_pos]]
+        df_by_country['count'] = counts[fall_pos, country_pos]
+        df_by_country.sort_values(by='count', inplace=True)
+        df_by_country['density'] = df_by_country['count'] / df_by_country['Area (km sq)']
+        return df_by_country
+
+    def by_years(self, years, fall):
+        start, stop = self._range(years)
+        fall_index = self._fall_index(fall)
+        counts = self.year_counts[start:stop, fall_index]
+
+        year_pos, fall_pos = np.nonzero(counts)
+        return pd.DataFrame({
+            'year': self.years[start + year_pos],
+            'fall': self.fall_values[fall_index[fall_pos]],
+            'count': counts[year_pos, fall_pos],
+        })
+
+    def export(self):
+        """Non-zero (year, fall, country) counts and the country table, as JSON-ready lists."""
+        counts = np.diff(self.cumulative, axis=0)
+        year_pos, fall_pos, country_pos = np.nonzero(counts)
+        cells = (year_pos, fall_pos, country_pos, counts[year_pos, fall_pos, country_pos])
+        return export_counts(self.years, self.fall_values, self.countries, cells, self.year_counts)
@@ -0,0 +1,305 @@
+"""The meteorite table with its indexes, and hot reload of ingested batches.
+
+New rows are ingested as batch files listed in ``data/VERSION.json`` (see
+``meteorites.ingest``). A running worker checks the mtime of that file at
+most every ``RELOAD_INTERVAL`` seconds. New batches go to a small side table
+with indexes of its own, queried along with the table, which stays as it was
+loaded (memory-mapped from the snapshot) until the batches are compacted;
+the compacted table is then loaded in a background thread. Either way a new
+``MeteoriteData`` is swapped in. The app binds the dataset to each request
+when it starts, so a request running across a swap (a long export included)
+reads the object it started with throughout.
+"""
+import copy
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from meteorites import compact
+from meteorites.bitmaps import MASS_COLUMN, FilterIndex
+from meteorites.cube import COUNTRY_COLUMNS, CountCube, merge_exports
+from meteorites.index import MeteoriteIndex
+from meteorites.metrics import timed
+from meteorites.snapshot import CSV_PATH, SNAPSHOT_DIR, load_table, source_digest
+from meteorites.spatial import GridIndex
+
+VERSION_FILE = 'data/VERSION.json'
+BATCH_DIR = 'data/batches'
+RELOAD_INTERVAL = float(os.environ.get('METEORITES_RELOAD_INTERVAL', 1))
+
+
+def read_version(version_file=VERSION_FILE):
+    try:
+        with open(version_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'batches': []}
+
+
+def read_batches(names, batch_dir=BATCH_DIR):
+    rows = pd.concat([pd.read_csv(os.path.join(batch_dir, name)) for name in names], ignore_index=True)
+    return rows.sort_values(by=['year'], kind='mergesort', ignore_index=True)
+
+
+def merge_sorted(df, rows):
+    """``df`` and ``rows``, both sorted by year, as one frame sorted by year, with ``rows`` last within a year."""
+    # each row goes after the rows of df of its year, missing years last
+    at = np.searchsorted(df['year'].to_numpy(), rows['year'].to_numpy(), side='right') + np.arange(len(rows))
+    from_rows = np.zeros(len(df) + len(rows), dtype=bool)
+    from_rows[at] = True
+    order = np.empty(len(from_rows), dtype=np.int64)
+    order[from_rows] = np.arange(len(df), len(from_rows))
+    order[~from_rows] = np.arange(len(df))
+    return pd.concat([df, rows], ignore_index=True).take(order).reset_index(drop=True)
+
+
+def add_counts(df, more, keys):
+    """Frames of ``keys`` and ``count``, with the counts of the same keys summed."""
+    return pd.concat([df, more], ignore_index=True).groupby(keys, observed=True, sort=False)['count'].sum() \
+        .reset_index()
+
+
+MAP_COLUMNS = ['reclat', 'reclong', 'year']
+
+
+def group_countries(df_by_country, xaxis):
+    df_other = df_by_country.groupby([xaxis, 'fall'], observed=True)[['count', 'Area (km sq)']].sum().reset_index()
+    df_other.sort_values(by='count', inplace=True)
+    df_other['density'] = df_other['count'] / df_other['Area (km sq)']
+    return df_other
+
+
+class MeteoriteData:
+    """In-memory (pandas) query backend.
+
+    Rows ingested since the table was loaded are in ``recent``, a ``MeteoriteData`` of their own; every query
+    adds its answer to the one of the table.
+    """
+
+    def __init__(self, df, version=0, batches=(), identity='pandas'):
+        self.df = df
+        self.version = version
+        # what the table was loaded from and how, see QueryCache.dataset
+        self.identity = identity
+        self.batches = list(batches)
+        self.index = MeteoriteIndex(df)
+        self.grid = GridIndex(df)
+        self.filters = FilterIndex(df)
+        self.cube = CountCube(df)
+        self.recent = None
+
+    def append(self, names, version, batch_dir=BATCH_DIR):
+        """The data with the batches ``names`` ingested; the table and its indexes are shared, not copied."""
+        batches = self.batches + list(names)
+        # a few rows per batch, indexing them all again is cheap
+        rows = read_batches(batches, batch_dir)
+        if compact.ENABLED:
+            # the names are kept for the counts, the frames only get the columns of the table
+            rows = compact.compact(rows, drop_name=False)
+        data = copy.copy(self)
+        data.version = version
+        data.batches = batches
+        data.recent = MeteoriteData(rows)
+        return data
+
+    def year_bounds(self):
+        low, high = self.df['year'].min(), self.df['year'].max()
+        if self.recent is not None:
+            recent_low, recent_high = self.recent.year_bounds()
+            # min and max keep the first value against a NaN
+            low, high = min(low, recent_low), max(high, recent_high)
+        return low, high
+
+    def values(self, column):
+        values = set(self.df[column].dropna().unique().tolist())
+        if self.recent is not None:
+            values.update(self.recent.values(column))
+        return sorted(values)
+
+    def mass_bounds(self):
+        mass = self.df[MASS_COLUMN]
+        low, high = mass[mass > 0].min(), mass.max()
+        if self.recent is not None:
+            recent_low, recent_high = self.recent.mass_bounds()
+            low, high = min(low, recent_low), max(high, recent_high)
+        return low, high
+
+    def _positions(self, years, fall, filters=None, bbox=None):
+        if bbox is None:
+            # binary search on the sorted years, then the precomputed fall positions
+            positions = self.index.positions(years, fall)
+        else:
+            # only the rows of the grid cells under the viewport are looked at
+            start, stop = self.index.year_slice(years)
+            positions = self.grid.query(bbox, start, stop, fall)
+        if filters is not None:
+            positions = self.filters.restrict(positions, filters)
+        return positions
+
+    def _recent(self, frame):
+        # a compact table may lack the name column the ingested rows keep
+        return frame[[column for column in self.df.columns if column in frame.columns]]
+
+    def filtered(self, years, fall, filters=None):
+        df = self._select(years, fall, filters)
+        if self.recent is None:
+            return df
+        return merge_sorted(df, self._recent(self.recent.filtered(years, fall, filters)))
+
+    def iter_filtered(self, years, fall, filters=None, chunk_rows=50000):
+        """The rows of ``filtered`` as frames of about ``chunk_rows`` rows, at least one."""
+        positions = self._positions(years, fall, filters)
+        if isinstance(positions, slice):
+            starts = range(positions.start, positions.stop, chunk_rows)
+            chunks = (slice(start, min(start + chunk_rows, positions.stop)) for start in starts)
+        else:
+            chunks = (positions[start:start + chunk_rows] for start in range(0, len(positions), chunk_rows))
+        rows = self._recent(self.recent.filtered(years, fall, filters)) if self.recent is not None \
+            else self.df.iloc[:0]
+        done = 0
+        empty = True
+        for chunk in chunks:
+            frame = self.df.iloc[chunk]
+            # the ingested rows of the years before the last one of the chunk go with it,
+            # the rows of that year may still have table rows in the next chunk
+            until = max(np.searchsorted(rows['year'].to_numpy(), frame['year'].iloc[-1], side='left'), done)
+            if until > done:
+                frame = merge_sorted(frame, rows.iloc[done:until])
+                done = until
+            empty = False
+            yield frame
+        if done < len(rows) or empty:
+            yield rows.iloc[done:]
+
+    def map_frame(self, years, fall, bbox=None, filters=None):
+        columns = self.df.columns.get_indexer(MAP_COLUMNS)
+        df = self.df.iloc[self._positions(years, fall, filters, bbox), columns]
+        if self.recent is None:
+            return df
+        return merge_sorted(df, self.recent.map_frame(years, fall, bbox, filters))
+
+    @timed('filtering')
+    def _select(self, years, fall, filters=None):
+        # the rows an aggregation starts from, charged to filtering rather than to the aggregation
+        return self.df.iloc[self._positions(years, fall, filters)]
+
+    def _cube(self, years, fall, filters):
+        # the cube only knows years, fall and countries, other filters count the rows they keep
+        if filters is None:
+            return self.cube
+        return CountCube(self._select(years, fall, filters))
+
+    def by_country(self, years, fall, filters=None):
+        # difference of two year slices of the prefix-sum cube
+        df_by_country = self._cube(years, fall, filters).by_country(years, fall)
+        if self.recent is None:
+            return df_by_country
+        df_by_country = add_counts(df_by_country, self.recent.by_country(years, fall, filters),
+                                   COUNTRY_COLUMNS + ['fall'])
+        df_by_country.sort_values(by='count', inplace=True)
+        df_by_country['density'] = df_by_country['count'] / df_by_country['Area (km sq)']
+        return df_by_country
+
+    def by_other(self, years, fall, xaxis, filters=None):
+        return group_countries(self.by_country(years, fall, filters), xaxis)
+
+    def by_years(self, years, fall, filters=None):
+        df_years = self._cube(years, fall, filters).by_years(years, fall)
+        if self.recent is None:
+            return df_years
+        df_years = add_counts(df_years, self.recent.by_years(years, fall, filters), ['year', 'fall'])
+        return df_years.sort_values(by='year', kind='mergesort', ignore_index=True)
+
+    def export(self, filters=None):
+        export = self._cube(self.year_bounds(), self.cube.fall_values, filters).export()
+        if self.recent is None:
+            return export
+        return merge_exports(export, self.recent.export(filters))
+
+
+def folded(batches, included):
+    """The first ``batches`` that are in ``included``, the ones a compaction folded into the table already."""
+    included = set(included)
+    count = 0
+    while count < len(batches) and batches[count] in included:
+        count += 1
+    return batches[:count]
+
+
+def load_data(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR, version_file=VERSION_FILE, batch_dir=BATCH_DIR):
+    if compact.ENABLED:
+        df, included = compact.load_compact_table(csv_path, snapshot_dir)
+    else:
+        df, included = load_table(csv_path, snapshot_dir)
+    info = read_version(version_file)
+    layout = 'compact' if compact.ENABLED else 'full'
+    # a compaction stopped before VERSION.json was written still lists the batches it folded
+    applied = folded(info['batches'], included)
+    data = MeteoriteData(df, batches=applied, identity=f'pandas:{layout}:{source_digest(csv_path, snapshot_dir)}')
+    if len(info['batches']) > len(applied):
+        return data.append(info['batches'][len(applied):], info['version'], batch_dir)
+    data.version = info['version']
+    return data
+
+
+class DataReloader:
+
+    def __init__(self, data, loader=load_data, version_file=VERSION_FILE, batch_dir=BATCH_DIR,
+                 interval=RELOAD_INTERVAL):
+        self.data = data
+        self.loader = loader
+        self.version_file = version_file
+        self.batch_dir = batch_dir
+        self.interval = interval
+        self._checked_at = time.monotonic()
+        self._mtime = self._stat()
+        self._loading = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.version_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self):
+        """Return the current data, loading the new batches if the version file changed."""
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return self.data
+        self._checked_at = now
+        if self._loading is not None:
+            if self._loading.is_alive():
+                # the version file is looked at again once the table is loaded
+                return self.data
+            self._loading = None
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return self.data
+
+        info = read_version(self.version_file)
+        if info['version'] == self.data.version:
+            self._mtime = mtime
+            return self.data
+        applied = self.data.batches
+        if info['batches'][:len(applied)] == applied and len(info['batches']) > len(applied):
+            # a failed append raises before the mtime is kept, the batches are read again on the next check
+            self.data = self.data.append(info['batches'][len(applied):], info['version'], self.batch_dir)
+            self._mtime = mtime
+        else:
+            # batches were compacted into the csv, requests keep the current data until the table is loaded
+            self._mtime = mtime
+            self._loading = threading.Thread(target=self._load, daemon=True)
+            self._loading.start()
+        return self.data
+
+    def _load(self):
+        try:
+            self.data = self.loader()
+        except Exception:
+            # read the version file again on the next check
+            self._mtime = None
+            raise
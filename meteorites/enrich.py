@@ -0,0 +1,157 @@
+"""Offline enrichment of the NASA meteorite landings with country data.
+
+Batch version of ``notebooks/create_data_by_country.ipynb``: reverse
+geocodes every landing to a country, joins the country tables and maps the
+climate codes, then writes ``data/meteorites.csv`` (sorted by year), the
+``by_country`` and ``by_climate`` aggregates and the columnar snapshot,
+plus the Parquet file of the DuckDB backend when there is one.
+
+Coordinates are deduplicated and geocoded in bulk, in chunks spread over a
+process pool; the per-row lambdas of the notebook are dictionary mappings on
+whole columns. Needs ``reverse_geocoder`` on top of the app requirements::
+
+    python -m meteorites.enrich --input meteorites_clean.csv --workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import reverse_geocoder as rg
+
+from meteorites.backends import build_parquet
+from meteorites.snapshot import build_snapshot
+
+# names of the iso table that differ from the countries of the world table
+COUNTRY_NAMES = {
+    'USA': 'United States',
+    'LBY': 'Libya',
+    'ATF': 'Antarctica',
+    'TZA': 'Tanzania',
+    'BIH': 'Bosnia & Herzegovina',
+    'PRK': 'Korea, South',
+    'SGS': 'sgs',
+}
+
+ISO_CODES = {'ATF': 'ATA'}
+
+CLIMATE_CODES = {
+    '1': 'Desert',
+    '2': 'Tropical',
+    '3': 'Temperate',
+    '4': 'Temperate',
+    '1,5': 'Desert/Tropical',
+    '2,5': 'Tropical/Temperate',
+}
+
+# countries without a climate code in the countries of the world table
+CLIMATE_BY_COUNTRY = {
+    'Morocco': 'Desert',
+    'Libya': 'Desert',
+    'Tanzania': 'Tropical',
+    'Russia': 'Temperate',
+    'Canada': 'Temperate',
+    'Italy': 'Temperate',
+    'Slovenia': 'Temperate',
+    'Serbia': 'Temperate',
+}
+
+GROUP_COLUMNS = ['Country', 'ISO 3166-1 alpha-3', 'Population', 'Area (km sq)', 'Pop. Density (per sq. km.)',
+                 'GDP ($ per capita)', 'Climate', 'Region', 'fall']
+
+
+def _search(coordinates):
+    return [result['cc'] for result in rg.search([tuple(c) for c in coordinates], mode=1, verbose=False)]
+
+
+def country_codes(lat, lon, workers=None, chunk_size=20000):
+    """ISO alpha-2 code of the nearest place of every coordinate."""
+    coordinates = np.column_stack([lat, lon])
+    unique, inverse = np.unique(coordinates, axis=0, return_inverse=True)
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+    if workers == 1 or len(chunks) == 1:
+        results = [_search(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_search, chunks))
+    codes = np.array([code for result in results for code in result], dtype=object)
+    return codes[inverse.reshape(-1)]
+
+
+def enrich(df, country_code, countries_world, iso_codes, workers=None):
+    df = df.dropna(subset=['reclat', 'reclong']).copy()
+    df['ISO 3166-1 alpha-2'] = country_codes(df['reclat'].to_numpy(), df['reclong'].to_numpy(), workers)
+    df = df.merge(country_code, on=['ISO 3166-1 alpha-2'])
+    df.drop(['ISO 3166-1 alpha-2', 'ISO 3166-1 numérique'], axis=1, inplace=True)
+
+    iso_codes = iso_codes.rename(columns={'Alpha-3 code': 'ISO 3166-1 alpha-3'})
+    df = df.merge(iso_codes, on=['ISO 3166-1 alpha-3'])
+    df.drop(['Pays', 'Alpha-2 code', 'GeoLocation', 'Numeric code', 'ISO 3166-2'], axis=1, inplace=True, errors='ignore')
+
+    df.rename(columns={"English short name lower case": 'Country'}, inplace=True)
+    df['Country'] = df['ISO 3166-1 alpha-3'].map(COUNTRY_NAMES).fillna(df['Country'])
+
+    countries_world = countries_world.copy()
+    # remove space after name
+    countries_world['Country'] = countries_world['Country'].str[:-1]
+    df = df.merge(countries_world, on=['Country'])
+    df['ISO 3166-1 alpha-3'] = df['ISO 3166-1 alpha-3'].replace(ISO_CODES)
+
+    climate = df['Climate'].astype(str).map(CLIMATE_CODES)
+    df['Climate'] = climate.fillna(df['Country'].map(CLIMATE_BY_COUNTRY)).fillna('other')
+
+    return df.sort_values(by=['year', 'id'], kind='mergesort').reset_index(drop=True)
+
+
+def by_country(df, countries_coordinates):
+    df_by_country = df.groupby(GROUP_COLUMNS)[['fall']].count()
+    df_by_country.rename(columns={"fall": 'count'}, inplace=True)
+    df_by_country = df_by_country.reset_index()
+    countries_coordinates = countries_coordinates.rename(columns={"Alpha-3 code": 'ISO 3166-1 alpha-3'})
+    return df_by_country.merge(countries_coordinates, on=['ISO 3166-1 alpha-3'], how='left')
+
+
+def by_climate(df_by_country):
+    df_climate = df_by_country.groupby(['Climate'])[['count', 'Area (km sq)']].sum().reset_index()
+    df_climate.sort_values(by=['count', 'Climate'], inplace=True, kind='mergesort')
+    df_climate['density'] = df_climate['count'] / df_climate['Area (km sq)']
+    return df_climate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build data/meteorites.csv and the aggregates from the NASA data")
+    parser.add_argument('--input', default='meteorites_clean.csv')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--workers', type=int, default=None, help="geocoding processes, default: one per cpu")
+    parser.add_argument('--no-snapshot', action='store_true', help="do not rebuild the columnar snapshot")
+    args = parser.parse_args()
+
+    def data_file(name):
+        return os.path.join(args.data_dir, name)
+
+    start = time.perf_counter()
+    df = enrich(
+        pd.read_csv(args.input),
+        pd.read_csv(data_file('country_code.csv')),
+        pd.read_csv(data_file('countries_world.csv')),
+        pd.read_csv(data_file('iso-codes.csv')),
+        workers=args.workers,
+    )
+    df.to_csv(data_file('meteorites.csv'), index=False, header=True)
+    print(f"meteorites.csv: {len(df)} rows in {time.perf_counter() - start:.1f}s")
+
+    df_by_country = by_country(df, pd.read_csv(data_file('countries_coordinates.csv')))
+    df_by_country.to_csv(data_file('by_country.csv'), index=False, header=True)
+    by_climate(df_by_country).to_csv(data_file('by_climate.csv'), index=False, header=True)
+
+    if not args.no_snapshot:
+        build_snapshot(data_file('meteorites.csv'), data_file('snapshot'))
+    if os.path.exists(data_file('meteorites.parquet')):
+        build_parquet(data_file('meteorites.csv'), data_file('meteorites.parquet'))
+    print(f"done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
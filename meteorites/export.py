@@ -0,0 +1,128 @@
+"""Streaming export of the rows behind the current view.
+
+``/export.csv`` and ``/export.arrow`` stream the rows matching the year
+range, fall values and filters of their query string (see ``export_query``),
+as CSV or as an Arrow IPC stream. Rows are read and encoded
+``METEORITES_EXPORT_CHUNK`` at a time, so a worker holds one chunk whatever
+the size of the selection and however slowly the client reads. Arrow needs
+``pyarrow``.
+"""
+import os
+from urllib.parse import urlencode
+
+import flask
+
+from meteorites.bitmaps import make_filters
+
+CHUNK_ROWS = int(os.environ.get('METEORITES_EXPORT_CHUNK', 50000))
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+
+def export_query(years, fall, filters=None):
+    """Query string of the export links for the current controls."""
+    params = [('years', f'{years[0]},{years[1]}')]
+    # an empty value keeps an empty selection apart from no selection
+    params += [('fall', value) for value in fall] or [('fall', '')]
+    if filters is not None:
+        recclass, nametype, mass = filters
+        if recclass is not None:
+            params += [('recclass', value) for value in recclass]
+        if nametype is not None:
+            params += [('nametype', value) for value in nametype] or [('nametype', '')]
+        if mass is not None:
+            params += [(name, value) for name, value in zip(['mass_min', 'mass_max'], mass) if value is not None]
+    return urlencode(params)
+
+
+def parse_query(args):
+    """``(years, fall, filters)`` of an export query string."""
+    years = [int(value) for value in args['years'].split(',')]
+    # checked here, a bad range would only fail once the response has started
+    if len(years) != 2 or years[0] > years[1]:
+        raise ValueError(f"expected two years, first <= last: {args['years']}")
+    fall = [value for value in args.getlist('fall') if value]
+    nametype = [value for value in args.getlist('nametype') if value] if 'nametype' in args else None
+    mass = (args.get('mass_min', type=float), args.get('mass_max', type=float))
+    return years, fall, make_filters(args.getlist('recclass'), nametype, mass)
+
+
+def csv_chunks(frames):
+    for i, frame in enumerate(frames):
+        yield frame.to_csv(index=False, header=i == 0).encode()
+
+
+class _Chunks:
+    """Write target of the Arrow stream writer, handing out what was written so far."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_schema(frame):
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    for i, column in enumerate(frame.columns):
+        if frame[column].dtype == object:
+            # a chunk of missing values only would make it a null column
+            schema = schema.set(i, pa.field(column, pa.string()))
+    return schema
+
+
+def arrow_chunks(frames):
+    import pyarrow as pa
+
+    sink = _Chunks()
+    writer = None
+    for frame in frames:
+        if writer is None:
+            schema = arrow_schema(frame)
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_batch(pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+class DataExport:
+
+    def __init__(self, app, dataset, chunk_rows=CHUNK_ROWS):
+        self.dataset = dataset
+        self.chunk_rows = chunk_rows
+        server = app.server
+        server.add_url_rule('/export.csv', 'export_csv', self.csv_view)
+        server.add_url_rule('/export.arrow', 'export_arrow', self.arrow_view)
+
+    def _frames(self):
+        try:
+            years, fall, filters = parse_query(flask.request.args)
+        except (KeyError, ValueError):
+            flask.abort(400, "expected years=<first>,<last>")
+        # the generator keeps the data it started with, even if a reload swaps it
+        return self.dataset().iter_filtered(years, fall, filters, self.chunk_rows)
+
+    def csv_view(self):
+        return flask.Response(csv_chunks(self._frames()), mimetype='text/csv',
+                              headers={'Content-Disposition': 'attachment; filename=meteorites.csv'})
+
+    def arrow_view(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            flask.abort(501, "the Arrow export needs pyarrow")
+        return flask.Response(arrow_chunks(self._frames()), mimetype=ARROW_STREAM,
+                              headers={'Content-Disposition': 'attachment; filename=meteorites.arrow'})
@@ -0,0 +1,54 @@
+"""Row index over the year-sorted meteorite table.
+
+The table is sorted by year, so a year range is a contiguous slice found by
+binary search. Row positions for each ``fall`` value are kept sorted, so a
+fall filter inside that slice is two more binary searches per value. A query
+costs O(log n + size of the result) instead of a scan of the whole table.
+"""
+import numpy as np
+import pandas as pd
+
+
+class MeteoriteIndex:
+
+    def __init__(self, df):
+        # rows without a year sort last and are in no year range
+        known = int(df['year'].notna().sum())
+        if df['year'].iloc[known:].notna().any() or not df['year'].iloc[:known].is_monotonic_increasing:
+            raise ValueError("the meteorite table must be sorted by year, missing years last")
+        self.df = df
+        self.years = df['year'].to_numpy()[:known]
+        fall = df['fall'].to_numpy()
+        self.fall_positions = {
+            value: np.flatnonzero(fall == value)
+            for value in pd.unique(fall) if not pd.isna(value)
+        }
+
+    def year_slice(self, years):
+        start = int(np.searchsorted(self.years, years[0], side='left'))
+        stop = int(np.searchsorted(self.years, years[1], side='right'))
+        return start, max(start, stop)
+
+    def positions(self, years, fall):
+        """Sorted row positions matching the year range and fall values, or a slice when every fall matches."""
+        start, stop = self.year_slice(years)
+        fall = set(fall)
+        if fall.issuperset(self.fall_positions):
+            return slice(start, stop)
+
+        parts = []
+        for value in fall:
+            positions = self.fall_positions.get(value)
+            if positions is None:
+                continue
+            lo, hi = np.searchsorted(positions, [start, stop])
+            parts.append(positions[lo:hi])
+        if not parts:
+            return slice(0, 0)
+        if len(parts) == 1:
+            return parts[0]
+        # keep the table (year) order
+        return np.sort(np.concatenate(parts))
+
+    def filter(self, years, fall):
+        return self.df.iloc[self.positions(years, fall)]
@@ -0,0 +1,105 @@
+"""Ingest new meteorite rows without rebuilding the dataset.
+
+``python -m meteorites.ingest new_rows.csv`` stores the rows, which must have
+the columns of ``data/meteorites.csv``, as a batch file in ``data/batches``
+and lists it in ``data/VERSION.json``; running workers pick it up on their
+next request. ``python -m meteorites.ingest --compact`` folds the batches
+into the csv and rebuilds the snapshot, and the Parquet file of the DuckDB
+backend when there is one; a worker starting while it runs, or after it
+stopped half way, reads every batch once.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from meteorites.backends import PARQUET_PATH, build_parquet
+from meteorites.data import BATCH_DIR, VERSION_FILE, merge_sorted, read_batches, read_version
+from meteorites.snapshot import CSV_PATH, SNAPSHOT_DIR, build_snapshot, read_csv
+
+
+def write_version(info, version_file=VERSION_FILE):
+    # replace the file in one step, workers never read a partial version
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(version_file) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, version_file)
+
+
+def check_rows(rows, table):
+    """``rows`` with the columns of ``table``, numeric where the table is; ValueError for rows that can't be added."""
+    missing = set(table.columns) - set(rows.columns)
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(sorted(missing))}")
+    rows = rows[list(table.columns)].copy()
+    for column in table.columns:
+        if not pd.api.types.is_numeric_dtype(table[column]):
+            continue
+        values = pd.to_numeric(rows[column], errors='coerce')
+        # blanks stay missing, anything else has to parse
+        bad = values.isna() & rows[column].notna()
+        if column == 'year':
+            # the indexes are sorted by year, every ingested row needs one
+            bad |= ~np.isfinite(values.astype(float))
+        if bad.any():
+            raise ValueError(f"bad {column} values on rows {', '.join(str(i) for i in rows.index[bad][:10])}")
+        rows[column] = values
+    return rows
+
+
+def ingest(rows, csv_path=CSV_PATH, version_file=VERSION_FILE, batch_dir=BATCH_DIR):
+    # enough rows to tell the numeric columns of the table
+    rows = check_rows(rows, pd.read_csv(csv_path, nrows=1000))
+    columns = list(rows.columns)
+
+    info = read_version(version_file)
+    version = info['version'] + 1
+    name = f'batch-{version:06d}.csv'
+    os.makedirs(batch_dir, exist_ok=True)
+    rows[columns].sort_values(by=['year'], kind='mergesort').to_csv(
+        os.path.join(batch_dir, name), index=False, header=True)
+    write_version({'version': version, 'batches': info['batches'] + [name]}, version_file)
+    return version
+
+
+def compact(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR, version_file=VERSION_FILE, batch_dir=BATCH_DIR,
+            parquet_path=PARQUET_PATH):
+    info = read_version(version_file)
+    if not info['batches']:
+        return info['version']
+    df = merge_sorted(read_csv(csv_path), read_batches(info['batches'], batch_dir))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(csv_path) or '.', suffix='.csv.tmp')
+    with os.fdopen(fd, 'w', newline='') as f:
+        df.to_csv(f, index=False, header=True)
+    # the snapshot and Parquet file are built from the new csv before it is swapped in: until then they are
+    # stale and workers read the old csv and the batches, afterwards they are fresh (a rename keeps the mtime
+    # they recorded) and list the batches they hold, which workers skip until VERSION.json drops them
+    try:
+        build_snapshot(tmp_path, snapshot_dir, info['batches'])
+        if os.path.exists(parquet_path):
+            build_parquet(tmp_path, parquet_path, batches=info['batches'])
+        os.replace(tmp_path, csv_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    version = info['version'] + 1
+    write_version({'version': version, 'batches': []}, version_file)
+    for name in info['batches']:
+        os.remove(os.path.join(batch_dir, name))
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add meteorite rows to the running dashboard")
+    parser.add_argument('rows', nargs='?', help="csv file with the columns of data/meteorites.csv")
+    parser.add_argument('--compact', action='store_true', help="fold the ingested batches into the csv")
+    args = parser.parse_args()
+    if args.compact:
+        print(f"compacted, data version {compact()}")
+    elif args.rows:
+        print(f"ingested, data version {ingest(pd.read_csv(args.rows))}")
+    else:
+        parser.error("give a csv file of rows or --compact")
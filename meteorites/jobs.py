@@ -0,0 +1,43 @@
+"""Background jobs for the heavy callbacks, cancelled once superseded.
+
+With ``METEORITES_JOBS=1`` the map, bar chart and year chart callbacks run as
+Dash background callbacks: each request starts a process whose result is
+left in a diskcache directory (``METEORITES_JOBS_DIR``), and the browser polls
+for it every ``METEORITES_JOBS_POLL`` milliseconds. The browser keeps the
+latest job of each callback; when an input changes while a job is still
+running, the new request names the old job and its process is terminated, so
+workers stop computing states nobody will see.
+
+Jobs run in a process forked from the worker, so their query cache entries
+are only kept with a shared ``METEORITES_CACHE_DIR``. Needs
+``dash[diskcache]``; no broker is involved.
+"""
+import os
+
+ENABLED = os.environ.get('METEORITES_JOBS') == '1'
+JOBS_DIR = os.environ.get('METEORITES_JOBS_DIR', 'data/jobs')
+POLL_INTERVAL = int(os.environ.get('METEORITES_JOBS_POLL', 100))
+
+_manager = None
+
+
+def manager():
+    global _manager
+    if _manager is None:
+        try:
+            import diskcache
+            import multiprocess  # noqa: F401
+            import psutil  # noqa: F401
+        except ImportError as error:
+            raise ImportError(f'METEORITES_JOBS=1 needs dash[diskcache] (diskcache, multiprocess, psutil): {error}') from error
+        from dash import DiskcacheManager
+
+        _manager = DiskcacheManager(diskcache.Cache(JOBS_DIR))
+    return _manager
+
+
+def callback_options():
+    """Keyword arguments of ``app.callback`` for a heavy callback."""
+    if not ENABLED:
+        return {}
+    return dict(background=True, manager=manager(), interval=POLL_INTERVAL)
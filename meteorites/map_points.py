@@ -0,0 +1,74 @@
+"""Zoom-aware point payload for the scattermapbox map.
+
+At low zoom the meteorites are binned on a lat/lon grid whose cells shrink as
+the zoom grows, and one marker per cell is sent, sized by its count. Single
+points are sent only when zoomed in past ``METEORITES_MAP_BIN_ZOOM`` and when
+there are at most ``METEORITES_MAP_MAX_POINTS`` of them. Binned responses are
+coarsened until they fit the same cap, so a response never holds more than
+``MAX_POINTS`` markers.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+BIN_BELOW_ZOOM = float(os.environ.get('METEORITES_MAP_BIN_ZOOM', 4))
+MAX_POINTS = int(os.environ.get('METEORITES_MAP_MAX_POINTS', 5000))
+# grid cells across the 360 degrees of longitude at zoom 0, doubled at every zoom level
+CELLS_AT_ZOOM_0 = int(os.environ.get('METEORITES_MAP_CELLS', 64))
+
+
+def zoom_level(zoom):
+    return max(int(np.floor(zoom)), 0)
+
+
+def cell_size(level):
+    return 360 / (CELLS_AT_ZOOM_0 * 2 ** level)
+
+
+def marker_size(count):
+    return np.minimum(5 + 3 * np.log2(count), 30)
+
+
+def bin_points(lat, lon, cell):
+    rows = np.floor((lat + 90) / cell).astype(np.int64)
+    cols = np.floor((lon + 180) / cell).astype(np.int64)
+    cell_id = rows * (int(np.ceil(360 / cell)) + 1) + cols
+    _, inverse, counts = np.unique(cell_id, return_inverse=True, return_counts=True)
+
+    # place the marker on the mean position of its meteorites rather than the cell center
+    return pd.DataFrame({
+        'reclat': np.bincount(inverse, weights=lat) / counts,
+        'reclong': np.bincount(inverse, weights=lon) / counts,
+        'count': counts,
+    })
+
+
+def map_points(df_filter, level):
+    """Return ``(points, binned)``, points having reclat, reclong and year, or count and size when binned."""
+    lat = df_filter['reclat'].to_numpy(dtype=np.float64)
+    lon = df_filter['reclong'].to_numpy(dtype=np.float64)
+    located = np.isfinite(lat) & np.isfinite(lon)
+
+    if level >= BIN_BELOW_ZOOM and np.count_nonzero(located) <= MAX_POINTS:
+        return df_filter.loc[located, ['reclat', 'reclong', 'year']], False
+
+    return binned_points(lat[located], lon[located], level), True
+
+
+def binned_points(lat, lon, level, weight=1):
+    points = bin_points(lat, lon, cell_size(level))
+    while len(points) > MAX_POINTS and level > 0:
+        level -= 1
+        points = bin_points(lat, lon, cell_size(level))
+    points['count'] *= weight
+    points['size'] = marker_size(points['count'].to_numpy())
+    return points
+
+
+def preview_points(df_sample, level, weight):
+    """Binned points of a sample keeping one row in ``weight``, one zoom level coarser than ``level``."""
+    lat = df_sample['reclat'].to_numpy(dtype=np.float64)
+    lon = df_sample['reclong'].to_numpy(dtype=np.float64)
+    located = np.isfinite(lat) & np.isfinite(lon)
+    return binned_points(lat[located], lon[located], max(level - 1, 0), weight), True
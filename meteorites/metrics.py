@@ -0,0 +1,176 @@
+"""Per-callback latency and payload instrumentation.
+
+Enabled with ``METEORITES_METRICS=1``. Every ``/_dash-update-component``
+request gets a ``Server-Timing`` header splitting its wall time into
+filtering, aggregation and serialization, and the totals per callback are
+served in the Prometheus text format at ``/metrics``. Metrics are kept per
+process: with several gunicorn workers each one reports its own requests.
+
+Functions are attributed to a phase with ``@timed(phase)``. Phases are
+exclusive: a timed function calling another one is only charged for its own
+time, so the rows an aggregation selects with filters count as filtering
+(the DuckDB backend filters and aggregates in one query, all aggregation).
+Serialization also covers the time between the return of the last timed
+function and the end of the request, which is where Dash encodes the
+response.
+"""
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+
+import flask
+
+ENABLED = os.environ.get('METEORITES_METRICS') == '1'
+PHASES = ['filtering', 'aggregation', 'serialization']
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+DASH_UPDATE = '/_dash-update-component'
+
+
+def timed(phase):
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not flask.has_request_context():
+                return func(*args, **kwargs)
+            # each level of the stack sums the time spent in the timed calls below it
+            stack = flask.g.setdefault('metrics_stack', [])
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = stack.pop()
+                phases = flask.g.setdefault('metrics_phases', defaultdict(float))
+                phases[phase] += elapsed - children
+                if stack:
+                    stack[-1] += elapsed
+                else:
+                    flask.g.metrics_last_exit = time.perf_counter()
+
+        return wrapper
+
+    return decorator
+
+
+class CallbackMetrics:
+
+    def __init__(self, app, cache=None):
+        self.app = app
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.phase_seconds = defaultdict(float)
+        self.duration_sum = defaultdict(float)
+        self.duration_buckets = defaultdict(lambda: [0] * len(BUCKETS))
+        self.response_bytes = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+        if ENABLED:
+            server = app.server
+            server.before_request(self._start)
+            server.after_request(self._finish)
+            server.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _callback_name(self):
+        body = flask.request.get_json(silent=True) or {}
+        output = body.get('output', '')
+        callback = self.app.callback_map.get(output, {}).get('callback')
+        return getattr(callback, '__name__', output)
+
+    def _start(self):
+        if flask.request.path != DASH_UPDATE:
+            return
+        flask.g.metrics_start = time.perf_counter()
+        if self.cache is not None:
+            flask.g.metrics_cache = (self.cache.hits, self.cache.misses)
+
+    def _finish(self, response):
+        start = flask.g.get('metrics_start')
+        if start is None:
+            return response
+        end = time.perf_counter()
+        total = end - start
+        phases = dict(flask.g.get('metrics_phases', {}))
+        last_exit = flask.g.get('metrics_last_exit')
+        if last_exit is not None:
+            phases['serialization'] = phases.get('serialization', 0.0) + end - last_exit
+
+        hits = misses = 0
+        if self.cache is not None:
+            hits_before, misses_before = flask.g.metrics_cache
+            hits, misses = self.cache.hits - hits_before, self.cache.misses - misses_before
+        size = response.calculate_content_length() or 0
+        name = self._callback_name()
+
+        with self._lock:
+            self.requests[name] += 1
+            if response.status_code >= 500:
+                self.errors[name] += 1
+            for phase, seconds in phases.items():
+                self.phase_seconds[name, phase] += seconds
+            self.duration_sum[name] += total
+            buckets = self.duration_buckets[name]
+            for i, bound in enumerate(BUCKETS):
+                if total <= bound:
+                    buckets[i] += 1
+            self.response_bytes[name] += size
+            self.cache_hits[name] += hits
+            self.cache_misses[name] += misses
+
+        timing = [f'{phase};dur={phases.get(phase, 0.0) * 1000:.2f}' for phase in PHASES]
+        timing.append(f'total;dur={total * 1000:.2f}')
+        timing.append(f'cache;desc="hits={hits} misses={misses}"')
+        response.headers.add('Server-Timing', ', '.join(timing))
+        return response
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}')
+
+        with self._lock:
+            names = sorted(self.requests)
+            metric('meteorites_callback_requests_total', 'counter', 'Dash update requests per callback.',
+                   [({'callback': n}, self.requests[n]) for n in names])
+            metric('meteorites_callback_errors_total', 'counter', 'Dash update requests that failed.',
+                   [({'callback': n}, self.errors[n]) for n in names])
+            metric('meteorites_callback_phase_seconds_total', 'counter', 'Time spent per callback and phase.',
+                   [({'callback': n, 'phase': p}, self.phase_seconds[n, p]) for n in names for p in PHASES])
+
+            lines.append('# HELP meteorites_callback_duration_seconds Wall time of the Dash update requests.')
+            lines.append('# TYPE meteorites_callback_duration_seconds histogram')
+            for n in names:
+                for bound, count in zip(BUCKETS, self.duration_buckets[n]):
+                    lines.append(f'meteorites_callback_duration_seconds_bucket{{callback="{n}",le="{bound}"}} {count}')
+                lines.append(f'meteorites_callback_duration_seconds_bucket{{callback="{n}",le="+Inf"}} '
+                             f'{self.requests[n]}')
+                lines.append(f'meteorites_callback_duration_seconds_sum{{callback="{n}"}} {self.duration_sum[n]}')
+                lines.append(f'meteorites_callback_duration_seconds_count{{callback="{n}"}} {self.requests[n]}')
+
+            metric('meteorites_callback_response_bytes_total', 'counter', 'Bytes sent by the Dash update requests.',
+                   [({'callback': n}, self.response_bytes[n]) for n in names])
+            metric('meteorites_callback_cache_hits_total', 'counter', 'Query cache hits during the callback.',
+                   [({'callback': n}, self.cache_hits[n]) for n in names])
+            metric('meteorites_callback_cache_misses_total', 'counter', 'Query cache misses during the callback.',
+                   [({'callback': n}, self.cache_misses[n]) for n in names])
+
+        if self.cache is not None:
+            stats = self.cache.stats()
+            metric('meteorites_query_cache_entries', 'gauge', 'Entries in the query cache of the process.',
+                   [({}, stats['size'])])
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return flask.Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,76 @@
+"""Approximate figures shown while the year slider is being dragged.
+
+The slider only sets ``value`` on mouseup, but it reports ``drag_value`` on
+every tick. Callbacks fired by a drag tick get a cheap preview instead of the
+exact figures, which replace it once the slider is released:
+
+- the drag years are snapped outward to ``METEORITES_PREVIEW_STEP`` years, so
+  ticks and users share a small set of cached queries
+- the map is drawn from a fixed sample of at most ``METEORITES_PREVIEW_SAMPLE``
+  rows, binned one zoom level coarser, with counts scaled back up
+- the bar and year charts come from the count cube when no class, name type
+  or mass filter is set; with filters, from the count cube of a fixed sample
+  of the rows passing them, scaled back up the same way
+
+A drag tick therefore costs at most one pass over the sample, whatever the
+size of the catalogue, but it is still three requests per tick: the previews
+are off unless ``METEORITES_PREVIEW=1``.
+"""
+import os
+
+import numpy as np
+
+from meteorites.cube import CountCube
+
+ENABLED = os.environ.get('METEORITES_PREVIEW') == '1'
+STEP = int(os.environ.get('METEORITES_PREVIEW_STEP', 5))
+SAMPLE_SIZE = int(os.environ.get('METEORITES_PREVIEW_SAMPLE', 20000))
+
+
+def snap(years, bounds, step=STEP):
+    """Widen ``years`` to multiples of ``step`` from the first year, within ``bounds``."""
+    low, high = int(bounds[0]), int(bounds[1])
+    start = low + (int(years[0]) - low) // step * step
+    end = low + -(-(int(years[1]) - low) // step) * step
+    return [max(start, low), min(end, high)]
+
+
+def sample(df_map, size=SAMPLE_SIZE):
+    """Every n-th row of a map frame sorted by year, so that at most ``size`` remain, and n."""
+    weight = max(int(np.ceil(len(df_map) / size)), 1)
+    return df_map.iloc[::weight], weight
+
+
+def sample_cube(df, size=SAMPLE_SIZE):
+    """Count cube of a sample of ``df`` sorted by year, and the number of rows a sampled row stands for."""
+    df_sample, weight = sample(df, size)
+    return CountCube(df_sample), weight
+
+
+def scale_counts(df_counts, weight):
+    """Counts of a sample cube, in place, as estimates for the whole table."""
+    df_counts['count'] *= weight
+    if 'density' in df_counts.columns:
+        df_counts['density'] = df_counts['count'] / df_counts['Area (km sq)']
+    return df_counts
+
+
+def in_view(df_sample, years, bbox=None):
+    """Rows of the sample within ``years`` and, unless None, the ``(west, south, east, north)`` box."""
+    year = df_sample['year'].to_numpy()
+    start = np.searchsorted(year, years[0], side='left')
+    stop = np.searchsorted(year, years[1], side='right')
+    df_years = df_sample.iloc[start:stop]
+    if bbox is None:
+        return df_years
+
+    west, south, east, north = bbox
+    lat = df_years['reclat'].to_numpy(dtype=np.float64)
+    lon = df_years['reclong'].to_numpy(dtype=np.float64)
+    keep = (lat >= south) & (lat <= north)
+    if east > 180:
+        # the box crosses the antimeridian
+        keep &= (lon >= west) | (lon <= east - 360)
+    else:
+        keep &= (lon >= west) & (lon <= east)
+    return df_years[keep]
@@ -0,0 +1,47 @@
+"""Recording of the callback requests of real sessions.
+
+With ``METEORITES_RECORD=requests.jsonl`` every ``/_dash-update-component``
+request body is appended to that file with its time and a session key (the
+client address and user agent), one JSON object per line. Replay the
+recording with ``benchmarks/loadtest.py --recording requests.jsonl``.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import flask
+
+from meteorites import warmup
+
+RECORD_PATH = os.environ.get('METEORITES_RECORD')
+DASH_UPDATE = '/_dash-update-component'
+
+
+class SessionRecorder:
+
+    def __init__(self, app, path=RECORD_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path:
+            app.server.before_request(self._record)
+
+    def _record(self):
+        request = flask.request
+        if request.path != DASH_UPDATE or request.method != 'POST' or request.args \
+                or warmup.HEADER in request.headers:
+            # background callback polls and the warm-up are not interactions
+            return None
+        body = request.get_json(silent=True)
+        if body is None:
+            return None
+        client = f'{request.remote_addr} {request.user_agent.string}'
+        line = json.dumps({
+            'session': hashlib.sha1(client.encode()).hexdigest()[:12],
+            'time': time.time(),
+            'body': body,
+        })
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+        return None
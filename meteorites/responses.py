@@ -0,0 +1,156 @@
+"""ETags and a store of compressed responses for the Dash callbacks.
+
+A callback response only depends on its outputs, the values of its inputs
+and state (numbers normalized like the query cache keys, lists kept in
+order), the triggering properties, the data and the code, so its ETag is a
+hash of those. A response already
+sent to another client is replayed from the store, already compressed,
+without running the callback again. Browsers do not revalidate POST
+requests, so only clients sending ``If-None-Match`` themselves get 304s.
+
+The store keeps the body as Flask-Compress encoded it, so ``ResponseStore``
+must be created before ``Compress(server)``: Flask runs ``after_request``
+hooks in reverse order of registration. An entry is only replayed in an
+encoding the client accepts and that Flask-Compress would not change, other
+requests run the callback and store its answer in their encoding. Disable it
+with ``METEORITES_RESPONSE_STORE=0``.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import flask
+
+from meteorites.cache import normalize
+
+ENABLED = os.environ.get('METEORITES_RESPONSE_STORE', '1') != '0'
+MAXSIZE = int(os.environ.get('METEORITES_RESPONSE_STORE_SIZE', 256))
+DASH_UPDATE = '/_dash-update-component'
+ENCODINGS = ('br', 'gzip')
+
+
+def code_version(root):
+    """Fingerprint of the app sources, so a deploy changes every ETag."""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(root, '*.py')) + glob.glob(os.path.join(root, 'meteorites', '*.py'))):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:12]
+
+
+def canonical(value):
+    """``cache.normalize`` without the set semantics: the order of a checklist sets the order of the traces."""
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in value.items()}
+    return normalize(value)
+
+
+def _values(items):
+    # pattern-matching callbacks send lists of items for a wildcard
+    return [_values(item) if isinstance(item, list) else
+            [item.get('id'), item.get('property'), canonical(item.get('value'))] for item in items]
+
+
+def request_key(body):
+    """Canonical form of what the answer to a callback request depends on."""
+    key = {
+        'output': body.get('output'),
+        'inputs': _values(body.get('inputs') or []),
+        'state': _values(body.get('state') or []),
+        'changed': sorted(body.get('changedPropIds') or []),
+    }
+    return json.dumps(key, sort_keys=True, separators=(',', ':'), default=str)
+
+
+class ResponseStore:
+
+    def __init__(self, app, data_version, root, maxsize=MAXSIZE):
+        self.data_version = data_version
+        self.code = code_version(root)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._excluded = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        if ENABLED:
+            server = app.server
+            server.before_request(self._lookup)
+            server.after_request(self._store)
+
+    def etag(self, body):
+        digest = hashlib.sha1(f'{self.code}:{self.data_version()}:{request_key(body)}'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _replayable(encoding, data, accepted):
+        if encoding is not None:
+            return accepted[encoding] > 0
+        # Flask-Compress would compress a plain body again, and change its ETag, for a client accepting it
+        config = flask.current_app.config
+        return len(data) < config.get('COMPRESS_MIN_SIZE', 500) or not any(accepted[e] > 0 for e in ENCODINGS)
+
+    def _lookup(self):
+        request = flask.request
+        if request.path != DASH_UPDATE or request.method != 'POST':
+            return None
+        body = request.get_json(silent=True)
+        if body is None or body.get('output') in self._excluded:
+            return None
+        etag = self.etag(body)
+        flask.g.response_etag = etag
+
+        # Flask-Compress appends the encoding to the ETags of the bodies it compresses
+        for tag in request.if_none_match.as_set(include_weak=True):
+            if tag.split(':', 1)[0] == etag:
+                self.not_modified += 1
+                response = flask.Response(status=304)
+                response.set_etag(tag)
+                return response
+
+        accepted = request.accept_encodings
+        with self._lock:
+            for encoding in ENCODINGS + (None,):
+                entry = self._entries.get((etag, encoding))
+                if entry is not None and self._replayable(encoding, entry, accepted):
+                    self._entries.move_to_end((etag, encoding))
+                    self.hits += 1
+                    break
+            else:
+                return None
+
+        response = flask.Response(entry, mimetype='application/json')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(f'{etag}:{encoding}' if encoding is not None else etag)
+        # already compressed, keep Flask-Compress away
+        flask.g.response_replayed = True
+        return response
+
+    def _store(self, response):
+        etag = flask.g.get('response_etag')
+        if etag is None or flask.g.get('response_replayed') or response.status_code != 200 \
+                or response.direct_passthrough:
+            return response
+        encoding = response.headers.get('Content-Encoding')
+        response.set_etag(f'{etag}:{encoding}' if encoding is not None else etag)
+        with self._lock:
+            self._entries[etag, encoding] = response.get_data()
+            self._entries.move_to_end((etag, encoding))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return response
+
+    def exclude(self, outputs):
+        """Never store the responses of these outputs, e.g. background callbacks answering with a job."""
+        self._excluded.update(outputs)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,77 @@
+"""Compact figure serialization.
+
+Numeric trace arrays are sent in plotly's base64 typed-array form
+(``{'dtype': 'f8', 'bdata': '...'}``, understood by plotly.js >= 2.28)
+instead of JSON number lists, and the callback responses are encoded with
+orjson when it is installed. Set ``METEORITES_TYPED_ARRAYS=0`` to send plain
+lists.
+"""
+import base64
+import os
+
+import numpy as np
+import plotly.io as pio
+
+from meteorites.metrics import timed
+
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = 'orjson'
+except ImportError:
+    pass
+
+TYPED_ARRAYS = os.environ.get('METEORITES_TYPED_ARRAYS', '1') != '0'
+
+# trace attributes holding one value per point
+DATA_ARRAYS = ['x', 'y', 'customdata']
+MARKER_ARRAYS = ['size', 'color', 'opacity']
+# map coordinates do not need more than float32 precision (about a meter)
+FLOAT32_ARRAYS = ['lat', 'lon']
+
+# integer types plotly.js can read, smallest first; wider integers go out as float64
+INT_DTYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+
+def typed_array(values, float_dtype=np.float64):
+    """Base64 typed-array spec of ``values``, or ``values`` unchanged when it is not a numeric array."""
+    if not isinstance(values, (np.ndarray, list, tuple)) and not hasattr(values, 'to_numpy'):
+        return values
+    array = np.asarray(values)
+    if array.dtype.kind in 'iub':
+        if array.size:
+            low, high = array.min(), array.max()
+        else:
+            low = high = 0
+        for dtype in INT_DTYPES:
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                array = array.astype(dtype)
+                break
+        else:
+            array = array.astype(np.float64)
+    elif array.dtype.kind == 'f':
+        array = array.astype(float_dtype)
+    else:
+        return values
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+    return {'dtype': array.dtype.str[1:], 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+@timed('serialization')
+def encode_figure(fig):
+    """Replace the numeric arrays of the figure traces by typed arrays, in place."""
+    if not TYPED_ARRAYS:
+        return fig
+    for trace in fig['data']:
+        for key in DATA_ARRAYS:
+            if key in trace:
+                trace[key] = typed_array(trace[key])
+        for key in FLOAT32_ARRAYS:
+            if key in trace:
+                trace[key] = typed_array(trace[key], np.float32)
+        marker = trace.get('marker')
+        if marker is not None:
+            for key in MARKER_ARRAYS:
+                if key in marker:
+                    marker[key] = typed_array(marker[key])
+    return fig
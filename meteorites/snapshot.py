@@ -0,0 +1,164 @@
+"""Columnar snapshot of data/meteorites.csv.
+
+The snapshot is a directory of one ``.npy`` file per column, pre-sorted by
+year, plus a ``meta.json`` describing the columns and the CSV it was built
+from. Numeric columns are opened memory-mapped so every gunicorn worker shares
+the same pages; text columns are stored as integer codes and load as
+categoricals over those memory-mapped codes, or decoded to objects on request.
+
+Build it with ``python -m meteorites.snapshot``.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+CSV_PATH = 'data/meteorites.csv'
+SNAPSHOT_DIR = 'data/snapshot'
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_info(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _file_digest(csv_path)}
+
+
+def read_csv(csv_path=CSV_PATH):
+    return pd.read_csv(csv_path).sort_values(by=['year'], kind='mergesort').reset_index(drop=True)
+
+
+def build_snapshot(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR, batches=()):
+    """Write the snapshot of ``csv_path``, recording the ingested ``batches`` the csv already holds."""
+    df = read_csv(csv_path)
+
+    # write into a sibling directory and swap it in, so a worker never sees half a snapshot
+    tmp_dir = snapshot_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        entry = {'name': name, 'file': f'{i:03d}.npy'}
+        if pd.api.types.is_numeric_dtype(df[name]):
+            values = df[name].to_numpy()
+        else:
+            codes, categories = pd.factorize(df[name], sort=True)
+            values = codes.astype(np.min_scalar_type(-len(categories) - 1))
+            entry['categories'] = categories.tolist()
+        np.save(os.path.join(tmp_dir, entry['file']), values, allow_pickle=False)
+        columns.append(entry)
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'rows': len(df),
+        'columns': columns,
+        'source': source_info(csv_path),
+        'batches': list(batches),
+    }
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+    return meta
+
+
+def read_meta(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION:
+        return None
+    return meta
+
+
+def is_stale(meta, csv_path=CSV_PATH):
+    if meta is None:
+        return True
+    if not os.path.exists(csv_path):
+        # the snapshot is all we have
+        return False
+    source = meta['source']
+    stat = os.stat(csv_path)
+    if stat.st_size != source['size']:
+        return True
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return False
+    # a fresh checkout or deploy touches mtimes, compare the content instead
+    return _file_digest(csv_path) != source['sha256']
+
+
+def source_digest(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """sha256 of the csv, taken from the snapshot when it is up to date."""
+    meta = read_meta(snapshot_dir)
+    if not is_stale(meta, csv_path):
+        return meta['source']['sha256']
+    return _file_digest(csv_path)
+
+
+def _is_categorical(name, categorical):
+    return categorical is True or name in (categorical or ())
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR, meta=None, categorical=True):
+    """The snapshot table; text columns in ``categorical`` (all of them when True) are categoricals, the others objects."""
+    if meta is None:
+        meta = read_meta(snapshot_dir)
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(snapshot_dir, entry['file']), mmap_mode='r', allow_pickle=False)
+        if 'categories' in entry and _is_categorical(entry['name'], categorical):
+            # the stored codes are the category codes, -1 included
+            values = pd.Categorical.from_codes(values, entry['categories'])
+        elif 'categories' in entry:
+            # code -1 is a missing value, it picks the trailing NaN
+            lookup = np.empty(len(entry['categories']) + 1, dtype=object)
+            lookup[:-1] = entry['categories']
+            lookup[-1] = np.nan
+            values = lookup[values]
+        data[entry['name']] = values
+    # copy=False keeps one block per column, so the numeric ones stay memory-mapped
+    return pd.DataFrame(data, copy=False)
+
+
+def load_table(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR, categorical=True):
+    """``(table, batches)``: the table of ``load_meteorites`` and the ingested batches it already holds."""
+    meta = read_meta(snapshot_dir)
+    if is_stale(meta, csv_path):
+        print("meteorites snapshot missing or stale, reading the csv")
+        df = read_csv(csv_path)
+        # the same dtypes the snapshot gives
+        for name in df.columns:
+            if not pd.api.types.is_numeric_dtype(df[name]) and _is_categorical(name, categorical):
+                df[name] = df[name].astype('category')
+        return df, []
+    return load_snapshot(snapshot_dir, meta, categorical), meta.get('batches', [])
+
+
+def load_meteorites(csv_path=CSV_PATH, snapshot_dir=SNAPSHOT_DIR, categorical=True):
+    """The meteorite table, with the text columns in ``categorical`` (all of them when True) as categoricals."""
+    return load_table(csv_path, snapshot_dir, categorical)[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the columnar snapshot of the meteorites csv")
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--out', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    meta = build_snapshot(args.csv, args.out)
+    print(f"wrote {meta['rows']} rows, {len(meta['columns'])} columns to {args.out}")
@@ -0,0 +1,97 @@
+"""Uniform grid index on reclat/reclong for viewport culling.
+
+Rows are bucketed once into cells of ``cell`` degrees and stored sorted by
+cell, so the rows of one latitude band of a bounding box are a single
+contiguous run. A viewport query only touches the rows of the cells it
+overlaps, then applies the exact box and the year/fall filters to them.
+"""
+import numpy as np
+
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+
+def viewport_bbox(relayout, margin=0.25, snap=1.0):
+    """Bounding box ``(west, south, east, north)`` of the map, or None for the whole world.
+
+    The visible corners come from ``mapbox._derived`` in the graph relayoutData. The box is grown by
+    ``margin`` of its size on each side and snapped outward to ``snap`` degrees so small pans reuse it.
+    """
+    try:
+        coordinates = np.asarray(relayout['mapbox._derived']['coordinates'], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if coordinates.ndim != 2 or coordinates.shape[1] != 2:
+        return None
+
+    west, east = coordinates[:, 0].min(), coordinates[:, 0].max()
+    south, north = coordinates[:, 1].min(), coordinates[:, 1].max()
+    width, height = east - west, north - south
+    west, east = west - margin * width, east + margin * width
+    south, north = max(south - margin * height, -90.0), min(north + margin * height, 90.0)
+    if east - west >= 360:
+        if south <= -90 and north >= 90:
+            return None
+        west, east = -180.0, 180.0
+
+    # mapbox keeps counting longitudes past the antimeridian, bring west back in [-180, 180)
+    shift = np.floor((west + 180) / 360) * 360
+    west, east = west - shift, east - shift
+    return (float(np.floor(west / snap) * snap), float(np.floor(south / snap) * snap),
+            float(np.ceil(east / snap) * snap), float(np.ceil(north / snap) * snap))
+
+
+class GridIndex:
+
+    def __init__(self, df, cell=1.0):
+        self.cell = cell
+        self.n_rows = int(np.ceil(180 / cell))
+        self.n_cols = int(np.ceil(360 / cell))
+        self.lat = df['reclat'].to_numpy(dtype=np.float64)
+        self.lon = df['reclong'].to_numpy(dtype=np.float64)
+        self.fall = df['fall'].to_numpy()
+
+        located = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        cell_id = self._rows(self.lat[located]) * self.n_cols + self._cols(self.lon[located])
+        order = np.argsort(cell_id, kind='stable')
+        self.positions = located[order]
+        self.offsets = np.zeros(self.n_rows * self.n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_id, minlength=self.n_rows * self.n_cols), out=self.offsets[1:])
+
+    def _rows(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90) / self.cell), 0, self.n_rows - 1).astype(np.int64)
+
+    def _cols(self, lon):
+        return np.clip(np.floor((np.asarray(lon) + 180) / self.cell), 0, self.n_cols - 1).astype(np.int64)
+
+    def _candidates(self, west, south, east, north):
+        c0, c1 = self._cols([west, east])
+        r0, r1 = self._rows([south, north])
+        first = np.arange(r0, r1 + 1) * self.n_cols
+        return [self.positions[self.offsets[row + c0]:self.offsets[row + c1 + 1]] for row in first]
+
+    def query(self, bbox, start=0, stop=None, fall=None):
+        """Sorted positions of the rows inside ``bbox``, within rows ``[start, stop)`` and of a ``fall`` value."""
+        west, south, east, north = bbox
+        if east > 180:
+            # the box crosses the antimeridian
+            spans = [(west, 180.0), (-180.0, east - 360)]
+        else:
+            spans = [(west, east)]
+
+        parts = []
+        for span_west, span_east in spans:
+            parts.extend(self._candidates(span_west, south, span_east, north))
+        candidates = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        keep = (lat >= south) & (lat <= north)
+        in_span = np.zeros(len(candidates), dtype=bool)
+        for span_west, span_east in spans:
+            in_span |= (lon >= span_west) & (lon <= span_east)
+        keep &= in_span
+        keep &= candidates >= start
+        if stop is not None:
+            keep &= candidates < stop
+        if fall is not None:
+            keep &= np.isin(self.fall[candidates], list(fall))
+        return np.sort(candidates[keep])
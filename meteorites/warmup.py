@@ -0,0 +1,180 @@
+"""Warm-up of the default and popular views at server start.
+
+The first visitor after a deploy would otherwise pay for the filtering and
+aggregations of the default view. ``warm_up`` sends the callback requests the
+browser sends for the default layout through ``server.test_client()``, with
+the bodies the Dash renderer builds, so both the query cache and the store of
+compressed responses are filled (once per encoding of ``responses.ENCODINGS``).
+It then changes the year range to every range of ``METEORITES_WARMUP_RANGES``
+(e.g. ``1990-2013,1900-1950``) and, for each range, the bar chart to every
+value of ``METEORITES_WARMUP_DROPDOWNS`` (e.g. ``Region,Climate``), as a
+visitor of the default view would. It prints how long each view took.
+
+It runs at import, so in every gunicorn worker unless the app is preloaded,
+and is off unless ``METEORITES_WARMUP=1``. Use it with ``gunicorn --preload``
+(the workers inherit the warm caches of the master) or a shared
+``METEORITES_CACHE_DIR``.
+"""
+import gzip
+import json
+import os
+import time
+
+from meteorites.responses import DASH_UPDATE, ENCODINGS
+
+ENABLED = os.environ.get('METEORITES_WARMUP') == '1'
+# sent with the warm-up requests, which are not sessions to record
+HEADER = 'X-Meteorites-Warmup'
+
+
+def parse_ranges(text):
+    ranges = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        start, end = item.split('-')
+        ranges.append([int(start), int(end)])
+    return ranges
+
+
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def component_props(layout):
+    """``{(id, property): value}`` of every component of the layout that has an id."""
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            node_props = node['props']
+            if 'id' in node_props:
+                for name, value in node_props.items():
+                    props[node_props['id'], name] = value
+            stack.extend(value for value in node_props.values() if isinstance(value, (list, dict)))
+    return props
+
+
+def callback_body(callback, props, changed):
+    """Body of the request the Dash renderer sends for ``callback`` after ``changed`` (``(id, property)``)."""
+    def values(items):
+        return [dict(item, value=props.get((item['id'], item['property']))) for item in items]
+
+    output = callback['output']
+    if output.startswith('..'):
+        # several outputs, as in '..graph-map.figure...map-view.data..'
+        outputs = [dict(zip(['id', 'property'], item.rsplit('.', 1))) for item in output[2:-2].split('...')]
+    else:
+        outputs = dict(zip(['id', 'property'], output.rsplit('.', 1)))
+    body = {
+        'output': output,
+        'outputs': outputs,
+        'inputs': values(callback['inputs']),
+        'changedPropIds': [f'{component_id}.{prop}' for component_id, prop in changed],
+    }
+    if callback['state']:
+        body['state'] = values(callback['state'])
+    return body
+
+
+def views(props, ranges, dropdowns):
+    """(name, changes) of every view to warm after the default one, each reached from the default view."""
+    default_years = props['year-range-slider', 'value']
+    default_dropdown = props['chart-dropdown', 'value']
+    for years in [default_years] + [r for r in ranges if r != default_years]:
+        if years != default_years:
+            yield f'{years[0]}-{years[1]}', [{('year-range-slider', 'value'): years}]
+        for dropdown in [d for d in dropdowns if d != default_dropdown]:
+            steps = [{('year-range-slider', 'value'): years}] if years != default_years else []
+            yield f'{years[0]}-{years[1]} {dropdown}', steps + [{('chart-dropdown', 'value'): dropdown}]
+
+
+class WarmUp:
+    """Sends the callback requests of a session to the app, keeping the state a browser would keep."""
+
+    def __init__(self, app):
+        self.client = app.server.test_client()
+        self.callbacks = [dep for dep in self.client.get('/_dash-dependencies').get_json()
+                          if not dep.get('clientside_function')]
+        self.initial_props = component_props(self.client.get('/_dash-layout').get_json())
+
+    @staticmethod
+    def _read(response):
+        if response.status_code != 200:
+            return None
+        data = response.get_data()
+        encoding = response.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif encoding is not None:
+            return None
+        return json.loads(data)
+
+    def _post(self, body, encoding):
+        """Answer of a callback request, polling a background callback until its result."""
+        headers = {HEADER: '1', 'Accept-Encoding': encoding}
+        url = DASH_UPDATE
+        while True:
+            answer = self._read(self.client.post(url, json=body, headers=headers))
+            if answer is None:
+                return None
+            if 'cacheKey' in answer:
+                url = f"{DASH_UPDATE}?cacheKey={answer['cacheKey']}&job={answer['job']}"
+            elif 'response' in answer or url == DASH_UPDATE:
+                return answer
+            else:
+                time.sleep(0.05)
+
+    def send(self, props, changed):
+        """Send the requests fired by ``changed``, then keep their answers in ``props`` as the browser does."""
+        if changed:
+            callbacks = [callback for callback in self.callbacks
+                         if any((item['id'], item['property']) in changed for item in callback['inputs'])]
+        else:
+            callbacks = [callback for callback in self.callbacks if not callback.get('prevent_initial_call')]
+        for callback in callbacks:
+            body = callback_body(callback, props, changed)
+            # responses of background callbacks are not stored, one job is enough
+            encodings = ['gzip'] if callback.get('long') else ['gzip'] + [e for e in ENCODINGS if e != 'gzip']
+            answer = [self._post(body, encoding) for encoding in encodings][0]
+            for component_id, values in ((answer or {}).get('response') or {}).items():
+                for prop, value in values.items():
+                    props[component_id, prop] = value
+
+    def default_view(self):
+        """Send the requests of the first page load, return the props of the page after them."""
+        props = dict(self.initial_props)
+        self.send(props, [])
+        return props
+
+    def view(self, props, changes):
+        """Apply each step of ``changes`` to a copy of ``props``, as successive interactions."""
+        props = dict(props)
+        for step in changes:
+            props.update(step)
+            self.send(props, list(step))
+
+
+def warm_up(app, ranges=None, dropdowns=None):
+    """Send the requests of every view to the app, return ``(name, seconds)`` per view."""
+    if ranges is None:
+        ranges = parse_ranges(os.environ.get('METEORITES_WARMUP_RANGES', ''))
+    if dropdowns is None:
+        dropdowns = parse_list(os.environ.get('METEORITES_WARMUP_DROPDOWNS', ''))
+
+    report = []
+    start = time.perf_counter()
+    session = WarmUp(app)
+    props = session.default_view()
+    report.append(('default view', time.perf_counter() - start))
+    for name, changes in views(props, ranges, dropdowns):
+        view_start = time.perf_counter()
+        session.view(props, changes)
+        report.append((name, time.perf_counter() - view_start))
+    total = time.perf_counter() - start
+
+    for name, seconds in report:
+        print(f"warm-up {name}: {seconds * 1000:.1f} ms")
+    print(f"warm-up: {len(report)} views in {total:.2f} s")
+    return report
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture
+def table():
+    return generate(2000, seed=1)
+
+
+@pytest.fixture
+def csv_path(tmp_path, table):
+    path = str(tmp_path / 'meteorites.csv')
+    table.to_csv(path, index=False)
+    return path
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from meteorites.warmup import callback_body, component_props
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    # app.py loads data/meteorites.csv at import, give it a small table from a scratch directory
+    from benchmarks.synthetic import generate
+
+    scratch = tmp_path_factory.mktemp('app')
+    os.makedirs(scratch / 'data')
+    generate(2000, seed=1).to_csv(scratch / 'data' / 'meteorites.csv', index=False)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('mapbox_access_token', '')
+        monkeypatch.chdir(scratch)
+        import app
+        yield app
+
+
+@pytest.fixture
+def update_map(app_module):
+    """Sends ``update_map`` requests after ``changes``, keeping ``map-view`` from its answers like the browser."""
+    client = app_module.server.test_client()
+    props = component_props(client.get('/_dash-layout').get_json())
+    callback = next(dep for dep in client.get('/_dash-dependencies').get_json()
+                    if dep['output'] == '..graph-map.figure...map-view.data..')
+
+    def send(changes):
+        props.update(changes)
+        response = client.post('/_dash-update-component', json=callback_body(callback, props, list(changes)))
+        if response.status_code != 200:
+            return response.status_code, None, None
+        answer = response.get_json()['response']
+        if 'map-view' in answer:
+            props['map-view', 'data'] = answer['map-view']['data']
+        return response.status_code, answer['graph-map']['figure'], answer.get('map-view')
+
+    return send
+
+
+def move(west, south, east, north, zoom=3):
+    corners = [[west, north], [east, north], [east, south], [west, south]]
+    return {('graph-map', 'relayoutData'): {
+        'mapbox.center': {'lon': (west + east) / 2, 'lat': (south + north) / 2}, 'mapbox.zoom': zoom,
+        'mapbox.bearing': 0, 'mapbox.pitch': 0, 'mapbox._derived': {'coordinates': corners}}}
+
+
+def locations(patch):
+    return [operation['location'] for operation in patch['operations']]
+
+
+def test_first_call_sends_the_figure(update_map):
+    status, figure, view = update_map({})
+    assert status == 200
+    assert set(figure) == {'data', 'layout'} and figure['layout']['mapbox']['style'] == 'dark'
+    assert view['data'] is not None
+
+
+def test_style_change_only_patches_the_style(update_map):
+    update_map({})
+    status, figure, view = update_map({('type-map', 'value'): 'light'})
+    assert status == 200 and view is None
+    assert locations(figure) == [['layout', 'mapbox', 'style'], ['data', 0, 'marker', 'color']]
+
+
+def test_new_points_only_patch_the_data(update_map):
+    _, _, shown = update_map({})
+    status, figure, view = update_map(move(0.2, 10.2, 20.2, 30.2))
+    assert status == 200 and view['data'] != shown['data']
+    assert all(location[:2] == ['data', 0] for location in locations(figure))
+    assert {tuple(location[2:]) for location in locations(figure)} == {
+        ('lat',), ('lon',), ('customdata',), ('hovertemplate',), ('marker', 'size'), ('marker', 'opacity')}
+
+
+def test_move_keeping_the_points_is_prevented(update_map):
+    update_map({})
+    update_map(move(0.2, 10.2, 20.2, 30.2))
+    # a small pan snaps to the same box
+    assert update_map(move(0.4, 10.4, 20.4, 30.4))[0] == 204
+    assert update_map(move(0.4, 10.4, 20.4, 30.4, zoom=8))[0] == 200
@@ -0,0 +1,36 @@
+import pytest
+
+from meteorites import compact
+from meteorites.data import MeteoriteData, read_version
+from meteorites.ingest import ingest
+
+duckdb = pytest.importorskip('duckdb')
+
+from meteorites.backends import DuckDBBackend, build_parquet, verify  # noqa: E402
+
+
+@pytest.fixture
+def duckdb_backend(tmp_path, csv_path):
+    parquet_path = str(tmp_path / 'meteorites.parquet')
+    build_parquet(csv_path, parquet_path)
+    return DuckDBBackend(parquet_path)
+
+
+@pytest.mark.parametrize('layout', ['full', 'compact'])
+def test_backends_agree(table, duckdb_backend, layout):
+    df = compact.compact(table) if layout == 'compact' else table
+    assert verify(MeteoriteData(df), duckdb_backend) == []
+
+
+def test_backends_agree_with_an_ingested_batch(tmp_path, table, csv_path, duckdb_backend):
+    paths = {'version_file': str(tmp_path / 'VERSION.json'), 'batch_dir': str(tmp_path / 'batches')}
+    # a blank column must keep the type of the table
+    rows = table.sample(5, random_state=0).assign(**{'mass (g)': None})
+    version = ingest(rows, csv_path, **paths)
+    names = read_version(paths['version_file'])['batches']
+
+    candidate = duckdb_backend.append(names, version, paths['batch_dir'])
+    reference = MeteoriteData(table).append(names, version, paths['batch_dir'])
+    assert candidate.mass_bounds() == pytest.approx(reference.mass_bounds())
+    assert len(candidate.filtered(candidate.year_bounds(), ['Fell', 'Found'])) == len(table) + 5
+    assert verify(reference, candidate, year_ranges=[reference.year_bounds(), (1900, 1950)]) == []
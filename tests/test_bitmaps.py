@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from meteorites.bitmaps import MASS_COLUMN, FilterIndex, make_filters
+
+
+def test_make_filters():
+    assert make_filters() is None
+    assert make_filters(recclass=[], mass=(None, None)) is None
+    assert make_filters(['L6', 'H5', 'L6']) == (('H5', 'L6'), None, None)
+    # an empty name type selection keeps no row, unlike no selection
+    assert make_filters(nametype=[]) == (None, (), None)
+
+
+def expected_mask(table, recclass=None, nametype=None, mass=None):
+    mask = np.ones(len(table), dtype=bool)
+    if recclass is not None:
+        mask &= table['recclass'].isin(recclass).to_numpy()
+    if nametype is not None:
+        mask &= table['nametype'].isin(nametype).to_numpy()
+    if mass is not None:
+        low, high = mass
+        values = table[MASS_COLUMN].to_numpy()
+        mask &= (values >= (-np.inf if low is None else low)) & (values <= (np.inf if high is None else high))
+    return mask
+
+
+@pytest.mark.parametrize('recclass, nametype, mass', [
+    (['class 0', 'class 1'], None, None),
+    # rare classes are kept as positions rather than bitmaps
+    (['class 300', 'class 301', 'class 0'], None, None),
+    (None, ['Relict'], None),
+    (None, [], None),
+    (None, None, (10, 1000)),
+    (None, None, (None, 5)),
+    (['class 0', 'class 2'], ['Valid'], (1, None)),
+])
+def test_restrict_matches_a_mask(table, recclass, nametype, mass):
+    table = table.copy()
+    table.loc[table.index[::50], MASS_COLUMN] = np.nan
+    index = FilterIndex(table)
+    filters = make_filters(recclass, nametype, mass)
+    expected = np.flatnonzero(expected_mask(table, *filters))
+
+    assert index.restrict(slice(0, len(table)), filters).tolist() == expected.tolist()
+    # a slice not aligned on bytes, and an array of positions
+    assert index.restrict(slice(13, 1501), filters).tolist() == expected[(expected >= 13) & (expected < 1501)].tolist()
+    positions = np.arange(3, len(table), 7)
+    assert index.restrict(positions, filters).tolist() == np.intersect1d(positions, expected).tolist()
@@ -0,0 +1,69 @@
+from meteorites.cache import DiskBackend, QueryCache, normalize
+
+
+def test_normalize():
+    assert normalize(['Found', 'Fell', 'Fell']) == ('Fell', 'Found')
+    assert normalize([1990.0, 2013]) == (1990, 2013)
+    assert hash(normalize([['a'], [1.0]])) == hash((('a',), (1,)))
+
+
+def test_memoize_computes_once_per_normalized_arguments():
+    cache = QueryCache()
+    calls = []
+
+    @cache.memoize
+    def count(years, fall):
+        calls.append((years, fall))
+        return len(calls)
+
+    assert count([1990, 2013], ['Fell', 'Found']) == 1
+    assert count([1990.0, 2013.0], ['Found', 'Fell']) == 1
+    assert count([1990, 2012], ['Fell', 'Found']) == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_keys_hold_the_dataset_and_its_version():
+    cache = QueryCache()
+
+    @cache.memoize
+    def answer():
+        return (cache.dataset, cache.version)
+
+    cache.dataset = 'pandas:full:a'
+    assert answer() == ('pandas:full:a', 0)
+    cache.version = 1
+    assert answer() == ('pandas:full:a', 1)
+    cache.dataset = 'pandas:full:b'
+    assert answer() == ('pandas:full:b', 1)
+
+
+def test_keys_hold_the_data_key_of_the_request():
+    cache = QueryCache()
+    current = ['pandas:full:a', 0]
+    cache.data_key = lambda: tuple(current)
+
+    @cache.memoize
+    def answer():
+        return tuple(current)
+
+    assert answer() == ('pandas:full:a', 0)
+    current[1] = 1
+    assert answer() == ('pandas:full:a', 1)
+    current[1] = 0
+    assert answer() == ('pandas:full:a', 0) and cache.stats()['hits'] == 1
+
+
+def test_lru_bound():
+    cache = QueryCache(maxsize=2)
+    for key in 'abc':
+        cache.set(key, key)
+    assert cache.get('a') == (False, None)
+    assert cache.get('c') == (True, 'c')
+
+
+def test_disk_entries_are_shared(tmp_path):
+    first = QueryCache(backend=DiskBackend(str(tmp_path)))
+    second = QueryCache(backend=DiskBackend(str(tmp_path)))
+    first.set(('by_years', 'pandas', 0), [1, 2])
+    assert second.get(('by_years', 'pandas', 0)) == (True, [1, 2])
+    assert second.stats()['hits'] == 1 and second.shared_hits == 1
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from meteorites.cube import COUNTRY_COLUMNS, CountCube, export_frames, merge_exports
+
+
+@pytest.mark.parametrize('years', [(1700, 2013), (1900, 1950), (2000, 2000), (2020, 2030)])
+@pytest.mark.parametrize('fall', [['Fell', 'Found'], ['Fell'], []])
+def test_counts_match_a_groupby(table, years, fall):
+    cube = CountCube(table)
+    rows = table[table['year'].between(*years) & table['fall'].isin(fall)]
+
+    expected = rows.groupby(['Country', 'fall']).size()
+    actual = cube.by_country(years, fall).set_index(['Country', 'fall'])['count']
+    pd.testing.assert_series_equal(actual.sort_index(), expected.sort_index(), check_names=False)
+
+    expected = rows.groupby(['year', 'fall']).size()
+    actual = cube.by_years(years, fall).set_index(['year', 'fall'])['count']
+    pd.testing.assert_series_equal(actual.sort_index(), expected.sort_index(), check_names=False,
+                                   check_index_type=False)
+
+
+def test_rows_without_a_country_are_only_in_the_year_counts(table):
+    table = table.copy()
+    table.loc[table.index[:10], 'Country'] = None
+    cube = CountCube(table)
+    assert cube.by_country((1700, 2013), ['Fell', 'Found'])['count'].sum() == len(table) - 10
+    assert cube.by_years((1700, 2013), ['Fell', 'Found'])['count'].sum() == len(table)
+
+
+def test_merged_exports_count_both_tables(table):
+    head, tail = table.iloc[:1200], table.iloc[1200:]
+    cells, year_counts = export_frames(merge_exports(CountCube(head).export(), CountCube(tail).export()))
+    expected_cells, expected_years = export_frames(CountCube(table).export())
+    keys = ['year', 'fall'] + COUNTRY_COLUMNS
+    pd.testing.assert_frame_equal(cells.sort_values(keys, ignore_index=True),
+                                  expected_cells.sort_values(keys, ignore_index=True), check_like=True)
+    pd.testing.assert_frame_equal(year_counts, expected_years)
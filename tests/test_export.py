@@ -0,0 +1,52 @@
+import io
+import sys
+
+import dash
+from dash import html
+import pandas as pd
+import pytest
+
+from meteorites.data import MeteoriteData
+from meteorites.export import DataExport, export_query
+
+
+def export_client(data):
+    app = dash.Dash(__name__)
+    app.layout = html.Div()
+    DataExport(app, lambda: data, chunk_rows=300)
+    return app.server.test_client()
+
+
+@pytest.fixture
+def client(table):
+    return export_client(MeteoriteData(table))
+
+
+def test_csv_export(client, table):
+    response = client.get('/export.csv?' + export_query((1900, 1950), ['Fell', 'Found']))
+    assert response.status_code == 200
+    rows = pd.read_csv(io.BytesIO(response.get_data()))
+    assert len(rows) == table['year'].between(1900, 1950).sum()
+
+
+@pytest.mark.parametrize('years', ['1900', '1900,1950,2000', '1950,1900', '1900,later', None])
+def test_bad_years_are_rejected_before_streaming(client, years):
+    query = '' if years is None else f'years={years}&'
+    response = client.get(f'/export.csv?{query}fall=Fell')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('years', [(1700, 2013), (2020, 2030)])
+def test_duckdb_csv_export_without_pyarrow(monkeypatch, tmp_path, table, csv_path, years):
+    pytest.importorskip('duckdb')
+    from meteorites.backends import DuckDBBackend, build_parquet
+
+    parquet_path = str(tmp_path / 'meteorites.parquet')
+    build_parquet(csv_path, parquet_path)
+    # only the Arrow download needs pyarrow
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    response = export_client(DuckDBBackend(parquet_path)).get('/export.csv?' + export_query(years, ['Fell', 'Found']))
+    assert response.status_code == 200
+    rows = pd.read_csv(io.BytesIO(response.get_data()))
+    assert list(rows.columns) == list(table.columns)
+    assert len(rows) == table['year'].between(*years).sum()
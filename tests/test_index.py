@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from meteorites.data import MeteoriteData
+from meteorites.index import MeteoriteIndex
+
+
+@pytest.fixture
+def missing_years(table):
+    table = table.astype({'year': float})
+    table.loc[table.index[-5:], 'year'] = np.nan
+    return table
+
+
+def test_year_range_and_fall(table):
+    index = MeteoriteIndex(table)
+    rows = index.filter((1900, 1950), ['Fell'])
+    expected = table[table['year'].between(1900, 1950) & (table['fall'] == 'Fell')]
+    assert rows.index.tolist() == expected.index.tolist()
+
+
+def test_missing_years_are_in_no_range(missing_years):
+    index = MeteoriteIndex(missing_years)
+    assert index.positions((1700, 2013), ['Fell', 'Found']) == slice(0, len(missing_years) - 5)
+    assert missing_years.iloc[index.positions((1700, 2013), ['Fell'])]['year'].notna().all()
+
+
+def test_missing_years_are_not_counted(missing_years):
+    data = MeteoriteData(missing_years)
+    assert len(data.filtered(data.year_bounds(), ['Fell', 'Found'])) == len(missing_years) - 5
+    assert data.by_years(data.year_bounds(), ['Fell', 'Found'])['count'].sum() == len(missing_years) - 5
+
+
+def test_unsorted_table(table):
+    with pytest.raises(ValueError):
+        MeteoriteIndex(table.iloc[::-1])
+    with pytest.raises(ValueError):
+        MeteoriteIndex(table.astype({'year': float}).assign(year=lambda df: df['year'].where(df.index != 0)))
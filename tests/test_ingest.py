@@ -0,0 +1,109 @@
+import os
+
+import pandas as pd
+import pytest
+
+from meteorites import ingest as ingest_module
+from meteorites.data import DataReloader, MeteoriteData, load_data, read_version
+from meteorites.ingest import compact, ingest, write_version
+from meteorites.snapshot import build_snapshot
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {'version_file': str(tmp_path / 'VERSION.json'), 'batch_dir': str(tmp_path / 'batches')}
+
+
+def test_ingest_adds_a_batch(table, csv_path, paths):
+    assert ingest(table.head(3), csv_path, **paths) == 1
+    info = read_version(paths['version_file'])
+    assert info == {'version': 1, 'batches': ['batch-000001.csv']}
+    assert len(pd.read_csv(os.path.join(paths['batch_dir'], info['batches'][0]))) == 3
+
+
+@pytest.mark.parametrize('year', [None, 'unknown'])
+def test_ingest_rejects_rows_without_a_year(table, csv_path, paths, year):
+    rows = table.head(3).astype({'year': object})
+    rows.loc[rows.index[1], 'year'] = year
+    with pytest.raises(ValueError, match='year'):
+        ingest(rows, csv_path, **paths)
+    assert read_version(paths['version_file'])['version'] == 0
+
+
+def test_ingest_rejects_unparseable_numbers(table, csv_path, paths):
+    rows = table.head(3).astype({'mass (g)': object})
+    rows.loc[rows.index[0], 'mass (g)'] = 'heavy'
+    with pytest.raises(ValueError, match='mass'):
+        ingest(rows, csv_path, **paths)
+
+
+def test_failed_append_is_retried(table, csv_path, paths):
+    reloader = DataReloader(MeteoriteData(table), interval=0, **paths)
+    # the batch is listed before it is written
+    write_version({'version': 1, 'batches': ['batch-000001.csv']}, paths['version_file'])
+    with pytest.raises(OSError):
+        reloader.check()
+    assert reloader.data.version == 0
+
+    os.makedirs(paths['batch_dir'])
+    table.head(3).to_csv(os.path.join(paths['batch_dir'], 'batch-000001.csv'), index=False)
+    data = reloader.check()
+    assert data.version == 1
+    assert len(data.filtered(data.year_bounds(), ['Fell', 'Found'])) == len(table) + 3
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(monkeypatch, name, after):
+    real = getattr(ingest_module, name)
+
+    def stop(*args, **kwargs):
+        if after:
+            real(*args, **kwargs)
+        raise Interrupted(name)
+
+    monkeypatch.setattr(ingest_module, name, stop)
+
+
+@pytest.fixture
+def ingested(tmp_path, table, csv_path, paths):
+    paths = dict(paths, snapshot_dir=str(tmp_path / 'snapshot'))
+    build_snapshot(csv_path, paths['snapshot_dir'])
+    ingest(table.head(5), csv_path, paths['version_file'], paths['batch_dir'])
+    return paths
+
+
+def loaders(csv_path, paths, parquet_path):
+    yield 'pandas', load_data(csv_path, paths['snapshot_dir'], paths['version_file'], paths['batch_dir'])
+    if parquet_path is not None:
+        from meteorites.backends import load_duckdb
+
+        yield 'duckdb', load_duckdb(parquet_path, csv_path, paths['version_file'], paths['batch_dir'])
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'duckdb'])
+@pytest.mark.parametrize('step, after', [(None, False), ('build_snapshot', True), ('build_parquet', True),
+                                         ('write_version', False)])
+def test_compact_stopped_at_any_step_counts_every_row_once(monkeypatch, tmp_path, table, csv_path, ingested,
+                                                           backend, step, after):
+    parquet_path = None
+    if backend == 'duckdb':
+        pytest.importorskip('duckdb')
+        from meteorites.backends import build_parquet
+
+        parquet_path = str(tmp_path / 'meteorites.parquet')
+        build_parquet(csv_path, parquet_path)
+    elif step == 'build_parquet':
+        pytest.skip("no Parquet file to build")
+    if step is not None:
+        interrupt(monkeypatch, step, after)
+    try:
+        compact(csv_path, ingested['snapshot_dir'], ingested['version_file'], ingested['batch_dir'],
+                parquet_path=str(tmp_path / 'meteorites.parquet'))
+    except Interrupted:
+        pass
+    for name, data in loaders(csv_path, ingested, parquet_path):
+        assert len(data.filtered(data.year_bounds(), ['Fell', 'Found'])) == len(table) + 5, name
+    assert not list(tmp_path.glob('*.tmp'))
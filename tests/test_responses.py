@@ -0,0 +1,70 @@
+import dash
+from dash import dcc, html
+from dash.dependencies import Input, Output
+from flask_compress import Compress
+
+from meteorites.responses import ResponseStore, request_key
+from meteorites.warmup import warm_up
+
+
+def body(fall):
+    return {'output': 'chart.children', 'outputs': {'id': 'chart', 'property': 'children'},
+            'inputs': [{'id': 'seen-found-check', 'property': 'value', 'value': fall}],
+            'changedPropIds': ['seen-found-check.value']}
+
+
+def test_request_key_keeps_the_order_of_lists():
+    assert request_key(body(['Fell', 'Found'])) != request_key(body(['Found', 'Fell']))
+    assert request_key(body([1990.0, 2000])) == request_key(body([1990, 2000]))
+
+
+def test_store_replays_only_the_same_order(tmp_path):
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.Checklist(id='seen-found-check', options=['Fell', 'Found']), html.Div(id='chart')])
+    calls = []
+
+    @app.callback(Output('chart', 'children'), Input('seen-found-check', 'value'))
+    def chart(fall):
+        calls.append(fall)
+        return ','.join(fall)
+
+    store = ResponseStore(app, lambda: 0, str(tmp_path))
+    client = app.server.test_client()
+    client.get('/')
+    answers = [client.post('/_dash-update-component', json=body(fall)).get_json()
+               for fall in (['Fell', 'Found'], ['Found', 'Fell'], ['Fell', 'Found'])]
+    assert [a['response']['chart']['children'] for a in answers] == ['Fell,Found', 'Found,Fell', 'Fell,Found']
+    assert calls == [['Fell', 'Found'], ['Found', 'Fell']]
+    assert store.hits == 1
+
+
+def test_warm_up_fills_the_store_for_the_first_visitor(tmp_path):
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.RangeSlider(id='year-range-slider', min=1900, max=2000, value=[1900, 2000]),
+                           dcc.Dropdown(id='chart-dropdown', options=['Country', 'Region'], value='Country'),
+                           html.Div(id='chart')])
+    calls = []
+
+    @app.callback(Output('chart', 'children'), Input('year-range-slider', 'value'), Input('chart-dropdown', 'value'))
+    def chart(years, dropdown):
+        calls.append((years, dropdown))
+        return f'{dropdown} {years}' * 200
+
+    store = ResponseStore(app, lambda: 0, str(tmp_path))
+    Compress(app.server)
+    warm_up(app, ranges=[[1950, 2000]], dropdowns=['Region'])
+    # once per encoding
+    assert calls[::2] == [([1900, 2000], 'Country'), ([1900, 2000], 'Region'), ([1950, 2000], 'Country'),
+                          ([1950, 2000], 'Region')]
+    warmed, hits = len(calls), store.hits
+
+    # the first page load of a browser
+    first = {'output': 'chart.children', 'outputs': {'id': 'chart', 'property': 'children'},
+             'inputs': [{'id': 'year-range-slider', 'property': 'value', 'value': [1900, 2000]},
+                        {'id': 'chart-dropdown', 'property': 'value', 'value': 'Country'}],
+             'changedPropIds': []}
+    for encoding in ('gzip, deflate, br', 'gzip'):
+        response = app.server.test_client().post('/_dash-update-component', json=first,
+                                                 headers={'Accept-Encoding': encoding})
+        assert response.status_code == 200
+    assert len(calls) == warmed and store.hits == hits + 2
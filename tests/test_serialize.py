@@ -0,0 +1,37 @@
+import base64
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from meteorites.serialize import typed_array
+
+
+def decode(spec):
+    return np.frombuffer(base64.b64decode(spec['bdata']), dtype='<' + spec['dtype'])
+
+
+@pytest.mark.parametrize('values, dtype', [
+    ([0, 1, 127], 'i1'),
+    ([-128, 127], 'i1'),
+    ([0, 255], 'u1'),
+    ([-1, 255], 'i2'),
+    ([0, 65535], 'u2'),
+    ([-1, 65535], 'i4'),
+    ([0, 2 ** 32 - 1], 'u4'),
+    ([-1, 2 ** 32 - 1], 'f8'),
+    ([True, False], 'i1'),
+    ([], 'i1'),
+])
+def test_integers_take_the_smallest_type(values, dtype):
+    spec = typed_array(np.array(values) if values else np.array([], dtype=np.int64))
+    assert spec['dtype'] == dtype
+    assert decode(spec).tolist() == [int(v) for v in values]
+
+
+def test_floats_and_other_values():
+    assert typed_array(pd.Series([1.5, 2.5]))['dtype'] == 'f8'
+    spec = typed_array([1.5, 2.5], float_dtype=np.float32)
+    assert spec['dtype'] == 'f4' and decode(spec).tolist() == [1.5, 2.5]
+    assert typed_array(['Fell', 'Found']) == ['Fell', 'Found']
+    assert typed_array('text') == 'text'
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from meteorites.spatial import GridIndex, viewport_bbox
+
+
+def relayout(corners):
+    return {'mapbox._derived': {'coordinates': corners}}
+
+
+def box(west, south, east, north):
+    return [[west, north], [east, north], [east, south], [west, south]]
+
+
+def test_viewport_bbox_grows_and_snaps():
+    assert viewport_bbox(relayout(box(10.2, 20.5, 20.2, 30.5))) == (7.0, 18.0, 23.0, 33.0)
+    assert viewport_bbox({'mapbox.center': {'lon': 0, 'lat': 0}}) is None
+
+
+def test_viewport_bbox_across_the_antimeridian():
+    # mapbox counts on past 180 east of the antimeridian
+    assert viewport_bbox(relayout(box(170, -10, 190, 10)), margin=0) == (170.0, -10.0, 190.0, 10.0)
+    # and below -180 west of it, the box is brought back to a west in [-180, 180)
+    assert viewport_bbox(relayout(box(-190, -10, -170, 10)), margin=0) == (170.0, -10.0, 190.0, 10.0)
+    assert viewport_bbox(relayout(box(530, -10, 550, 10)), margin=0) == (170.0, -10.0, 190.0, 10.0)
+
+
+def test_viewport_bbox_of_the_whole_world():
+    assert viewport_bbox(relayout(box(-200, -90, 200, 90))) is None
+    assert viewport_bbox(relayout(box(-200, -10, 200, 10)), margin=0) == (-180.0, -10.0, 180.0, 10.0)
+
+
+def test_query_across_the_antimeridian():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'reclat': rng.uniform(-90, 90, 5000), 'reclong': rng.uniform(-180, 180, 5000),
+                       'fall': rng.choice(['Fell', 'Found'], 5000)})
+    index = GridIndex(df)
+    lat, lon = df['reclat'], df['reclong']
+    inside = (lat >= -10) & (lat <= 10) & ((lon >= 170) | (lon <= -170))
+    assert index.query((170.0, -10.0, 190.0, 10.0)).tolist() == np.flatnonzero(inside).tolist()
+    fell = inside & (df['fall'] == 'Fell') & (df.index >= 100) & (df.index < 4000)
+    assert index.query((170.0, -10.0, 190.0, 10.0), 100, 4000, ['Fell']).tolist() == np.flatnonzero(fell).tolist()